@@ -0,0 +1,130 @@
+from io import BytesIO
+from mmap import ACCESS_READ, mmap
+from pickle import HIGHEST_PROTOCOL, Pickler, Unpickler
+from struct import Struct
+from data import NODE_CLASSES, NODE_FIELDS
+
+# the binary format of an ast in the module cache:
+#
+#   magic, globals count, headers offset and size
+#   for each global: kind code, body offset and size
+#   the headers of all the globals and the bodies of each one
+#
+# the header of a global is its node without the body, the bodies of functions and tests are
+# only decoded when the generator reaches them, since most of the functions of a big package are
+# never generated by a program, both are encoded with the unpickler of the standard library, which
+# is faster than a decoder written in python, and they refer to the source file of the module
+# instead of carrying a copy of it
+#
+# so the file has no string table and no offsets between nodes: the unit decoded lazily is the body
+# of a global, a separate pickle blob found through the table of globals, the strings are shared
+# only inside a blob, and the nodes of a blob are decoded all together
+MAGIC = b'ZPPAST01'
+HEADER = Struct('<8sIII')
+GLOBAL = Struct('<HII')
+
+NODE_KINDS = list(NODE_FIELDS)
+NODE_CODES = { kind: code for code, kind in enumerate(NODE_KINDS) }
+
+def load_lazy_body(self, name):
+  # only called when the slot of the field was never set
+  if name != 'body' or self.lazy_body is None:
+    raise AttributeError(name)
+
+  reader, offset, size = self.lazy_body
+  self.lazy_body = None
+  self.body = reader.load_blob(offset, size)
+
+  return self.body
+
+LAZY_BODY_KINDS = ['fn_node', 'test_node']
+LAZY_NODE_CLASSES = {
+  kind: type(kind, (NODE_CLASSES[kind],), {
+    '__slots__': ('lazy_body',),
+    '__getattr__': load_lazy_body
+  }) for kind in LAZY_BODY_KINDS
+}
+
+class AstPickler(Pickler):
+  def __init__(self, f, file):
+    super().__init__(f, protocol=HIGHEST_PROTOCOL)
+    self.file = file
+
+  def persistent_id(self, obj):
+    return 0 if obj is self.file else None
+
+class AstUnpickler(Unpickler):
+  def __init__(self, f, file):
+    super().__init__(f)
+    self.file = file
+
+  def persistent_load(self, pid):
+    return self.file
+
+class AstReader:
+  def __init__(self, buffer, base, file):
+    self.buffer = buffer
+    self.base = base
+    self.file = file
+
+  def load_blob(self, offset, size):
+    start = self.base + offset
+    return AstUnpickler(BytesIO(self.buffer[start:start + size]), self.file).load()
+
+  def load_ast(self):
+    magic, globals_count, headers_offset, headers_size = HEADER.unpack_from(self.buffer, self.base)
+
+    if magic != MAGIC:
+      raise ValueError('not an ast file')
+
+    headers = self.load_blob(headers_offset, headers_size)
+    ast = []
+
+    for i, fields in enumerate(headers):
+      code, body_offset, body_size = GLOBAL.unpack_from(self.buffer, self.base + HEADER.size + GLOBAL.size * i)
+      kind = NODE_KINDS[code]
+      node = object.__new__(LAZY_NODE_CLASSES.get(kind, NODE_CLASSES[kind]))
+
+      for name, value in fields.items():
+        setattr(node, name, value)
+
+      if kind in LAZY_BODY_KINDS:
+        node.lazy_body = (self, body_offset, body_size)
+
+      ast.append(node)
+
+    return ast
+
+def dump_ast(f, ast, file):
+  headers = []
+  globals = []
+  blobs = BytesIO()
+
+  def dump_blob(obj):
+    offset = blobs.tell()
+    AstPickler(blobs, file).dump(obj)
+
+    return offset, blobs.tell() - offset
+
+  for node in ast:
+    fields = node.get_fields()
+    is_lazy = node.kind in LAZY_BODY_KINDS
+    body = fields.pop('body') if is_lazy else None
+
+    headers.append(fields)
+    globals.append((NODE_CODES[node.kind], *(dump_blob(body) if is_lazy else (0, 0))))
+
+  headers_offset, headers_size = dump_blob(headers)
+  blobs_offset = HEADER.size + GLOBAL.size * len(globals)
+  f.write(HEADER.pack(MAGIC, len(globals), blobs_offset + headers_offset, headers_size))
+
+  for code, body_offset, body_size in globals:
+    f.write(GLOBAL.pack(code, blobs_offset + body_offset, body_size))
+
+  f.write(blobs.getbuffer())
+
+def load_ast(f, file):
+  # the file is mapped in memory, the bodies are read from the mapping when they are
+  # decoded, replacing the file in the cache does not change what is already mapped
+  buffer = mmap(f.fileno(), 0, access=ACCESS_READ)
+  return AstReader(buffer, f.tell(), file).load_ast()
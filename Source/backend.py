@@ -0,0 +1,40 @@
+import llvmlite.binding as llvm
+
+from utils import error
+
+target_machines = {}
+
+def get_target_machine(opt_level):
+  if opt_level in target_machines:
+    return target_machines[opt_level]
+
+  llvm.initialize_native_target()
+  llvm.initialize_native_asmprinter()
+
+  target = llvm.Target.from_default_triple()
+  # position independent code, so that the objects can be linked into a pie executable
+  tm = target_machines[opt_level] = target.create_target_machine(
+    opt=opt_level, reloc='pic', codemodel='default'
+  )
+
+  return tm
+
+def emit_object(llvm_module, object_filepath, opt_level):
+  tm = get_target_machine(opt_level)
+
+  try:
+    # the module is built with `llvmlite.ir`, which can only be handed to llvm as assembly
+    m = llvm.parse_assembly(str(llvm_module))
+    m.triple = tm.triple
+    m.data_layout = str(tm.target_data)
+    m.verify()
+  except RuntimeError as e:
+    error(f'llvm error: {e}', None)
+
+  if opt_level > 0:
+    pto = llvm.create_pipeline_tuning_options(speed_level=opt_level)
+    pb = llvm.create_pass_builder(tm, pto)
+    pb.getModulePassManager().run(m, pb)
+
+  with open(object_filepath, 'wb') as f:
+    f.write(tm.emit_object(m))
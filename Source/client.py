@@ -0,0 +1,65 @@
+from hashlib import sha256
+from json import dumps
+from os import environ, getcwd
+from os.path import abspath, dirname, exists, expanduser, join
+from socket import AF_UNIX, SHUT_WR, SOCK_STREAM, socket
+from sys import argv, stderr
+
+import socket as sockets
+
+# this module is the thin client of `zpp serve`, it must stay cheap to start,
+# so it only imports the compiler when no server is available
+
+def get_socket_path():
+  # one server for each compiler location, the same way the module cache is keyed
+  source_dir = dirname(abspath(__file__))
+  base = environ.get('XDG_CACHE_HOME', expanduser('~/.cache'))
+
+  return join(base, 'zpp', f'serve-{sha256(source_dir.encode()).hexdigest()[:16]}.sock')
+
+def run_locally():
+  from main import run
+
+  return run()
+
+def send_request(s):
+  request = dumps({ 'argv': argv, 'cwd': getcwd() }).encode()
+
+  sockets.send_fds(s, [request], [0, 1, 2])
+  s.shutdown(SHUT_WR)
+
+  response = b''
+  while chunk := s.recv(4096):
+    response += chunk
+
+  return response.decode()
+
+def main():
+  socket_path = get_socket_path()
+
+  if not hasattr(sockets, 'send_fds') or not exists(socket_path):
+    return run_locally()
+
+  with socket(AF_UNIX, SOCK_STREAM) as s:
+    try:
+      s.connect(socket_path)
+    except OSError:
+      return run_locally()
+
+    try:
+      response = send_request(s)
+    except BrokenPipeError:
+      return run_locally()
+
+  # the server refuses requests when the compiler changed since it started
+  if response == 'stale':
+    return run_locally()
+
+  if response == '':
+    print('error: compile server closed the connection', file=stderr)
+    return 1
+
+  return int(response)
+
+if __name__ == '__main__':
+  exit(main())
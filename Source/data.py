@@ -1,4 +1,7 @@
-from utils import equal_dicts, error, has_infinite_recursive_layout
+from bisect import bisect_right
+from utils import align_to, equal_dicts, error, has_infinite_recursive_layout
+
+import utils
 
 indent_fmt = '  '
 
@@ -15,9 +18,23 @@ def repr_block(block):
   return f':\n{indent_fmt}  {t}'
 
 class Node:
+  # every kind in `NODE_FIELDS` has its own class with slots, `Node(kind, ...)` builds
+  # an instance of it, the other kinds (tokens made by the generator) use `DictNode`
+  __slots__ = ()
+
+  def __new__(cls, kind, **kwargs):
+    return object.__new__(NODE_CLASSES.get(kind, DictNode))
+
   def __init__(self, kind, **kwargs):
-    self.__dict__ = kwargs
-    self.kind = kind
+    for name, value in kwargs.items():
+      setattr(self, name, value)
+
+  def get_fields(self):
+    return { name: getattr(self, name) for name in self.field_names if hasattr(self, name) }
+
+  def __reduce__(self):
+    # the fields are restored as the state of the slots, without calling `__init__`
+    return new_node, (self.kind,), (None, self.get_fields())
   
   def __repr__(self):
     match self.kind:
@@ -83,7 +100,7 @@ class Node:
         return f'({self.if_expr} if {self.if_cond} else {self.else_expr})'
       
       case 'struct_type_node':
-        return f'({", ".join(self.fields)})'
+        return f'{"reorder!" if self.is_reordered else ""}({", ".join(map(repr, self.fields))})'
       
       case 'struct_init_node':
         return f'<struct_init_node {self.fields}>'
@@ -174,15 +191,179 @@ class Node:
         except AttributeError:
           raise NotImplementedError(self.kind)
 
+class DictNode(Node):
+  def __init__(self, kind, **kwargs):
+    self.__dict__ = kwargs
+    self.kind = kind
+
+  @property
+  def evaluate_fn_name(self):
+    return f'evaluate_{self.kind}'
+
+  def get_fields(self):
+    return { name: value for name, value in self.__dict__.items() if name != 'kind' }
+
+  def __reduce__(self):
+    return new_node, (self.kind,), self.__dict__
+
+def new_node(kind):
+  return object.__new__(NODE_CLASSES.get(kind, DictNode))
+
+NODE_FIELDS = {
+  'array_init_node': ['nodes', 'pos'],
+  'array_type_node': ['length', 'type', 'pos'],
+  'as_node': ['expr', 'type', 'op', 'is_chained_form', 'pos'],
+  'assignment_node': ['lexpr', 'op', 'rexpr', 'pos'],
+  'bin_node': ['op', 'left', 'right', 'pos'],
+  'break_node': ['pos'],
+  'call_node': ['name', 'generics', 'is_internal_call', 'args', 'pos'],
+  'case_branch_node': ['expr', 'body', 'pos'],
+  'continue_node': ['pos'],
+  'defer_node': ['body', 'pos'],
+  'dot_node': ['left_expr', 'right_expr', 'pos'],
+  'elif_branch_node': ['cond', 'body', 'pos'],
+  'else_branch_node': ['body', 'pos'],
+  'enum_node': ['id', 'pos'],
+  'fn_arg_node': ['name', 'type', 'pos'],
+  'fn_node': ['name', 'generics', 'args', 'ret_type', 'body', 'is_test', 'pos'],
+  'fn_type_node': ['arg_types', 'ret_type', 'pos'],
+  'for_node': ['left_node', 'mid_node', 'right_node', 'body', 'pos'],
+  'generic_type_node': ['name', 'generics', 'pos'],
+  'id_import_node': ['name', 'alias', 'pos'],
+  'if_branch_node': ['cond', 'body', 'pos'],
+  'if_node': ['if_branch', 'elif_branches', 'else_branch', 'pos'],
+  'import_node': ['path', 'ids', 'pos'],
+  'index_node': ['instance_expr', 'index_expr', 'pos'],
+  'inline_if_node': ['if_expr', 'if_cond', 'else_expr', 'pos'],
+  'match_node': ['expr_to_match', 'case_branches', 'else_branch', 'pos'],
+  'out_param_node': ['name', 'type', 'pos'],
+  'pass_node': ['pos'],
+  'ptr_type_node': ['type', 'is_mut', 'pos'],
+  'return_node': ['expr', 'pos'],
+  'struct_field_init_node': ['name', 'expr', 'pos'],
+  'struct_field_node': ['name', 'type', 'pos'],
+  'struct_init_node': ['fields', 'pos'],
+  'struct_type_node': ['fields', 'is_reordered', 'pos'],
+  'test_node': ['desc', 'body', 'pos'],
+  'try_node': ['var', 'expr', 'body', 'pos'],
+  'type_decl_node': ['name', 'generics', 'type', 'pos'],
+  'unary_node': ['op', 'expr', 'is_mut', 'is_chained_form', 'pos'],
+  'union_field_init_node': ['name', 'expr', 'pos'],
+  'union_field_node': ['name', 'type', 'pos'],
+  'union_init_node': ['fields', 'pos'],
+  'union_type_node': ['fields', 'pos'],
+  'var_decl_node': ['name', 'type', 'expr', 'pos'],
+  'var_try_node': ['name', 'type', 'pos'],
+  'vector_type_node': ['length', 'type', 'pos'],
+  'while_node': ['cond', 'body', 'pos']
+}
+
+NODE_CLASSES = {
+  kind: type(kind, (Node,), {
+    '__slots__': tuple(fields),
+    'field_names': tuple(fields),
+    'kind': kind,
+    # the generator dispatches on this, instead of formatting it for every node
+    'evaluate_fn_name': f'evaluate_{kind}'
+  }) for kind, fields in NODE_FIELDS.items()
+}
+
+class SourceFile:
+  def __init__(self, src, path):
+    self.src = src
+    self.path = path
+    self.line_starts = None
+
+  def apply_edit(self, start, end, text):
+    self.src = self.src[:start] + text + self.src[end:]
+    self.line_starts = None
+
+  def get_line_starts(self):
+    # only built when a position is rendered
+    if self.line_starts is None:
+      self.line_starts = [0]
+      index = self.src.find('\n')
+
+      while index != -1:
+        self.line_starts.append(index + 1)
+        index = self.src.find('\n', index + 1)
+
+    return self.line_starts
+
+  def get_line_and_col(self, offset):
+    line_starts = self.get_line_starts()
+    line = bisect_right(line_starts, offset)
+
+    return line, offset - line_starts[line - 1] + 1
+
+  def get_line_src(self, line):
+    line_starts = self.get_line_starts()
+    end = line_starts[line] - 1 if line < len(line_starts) else len(self.src)
+
+    return self.src[line_starts[line - 1]:end]
+
+class Pos:
+  # an offset in a source file, line and col are computed from it when needed
+  __slots__ = ('file', 'offset')
+
+  def __init__(self, file, offset):
+    self.file = file
+    self.offset = offset
+
+  def __reduce__(self):
+    # smaller and faster to load in the module cache than the default for slots
+    return Pos, (self.file, self.offset)
+
+  @property
+  def line(self):
+    return self.file.get_line_and_col(self.offset)[0]
+
+  @property
+  def col(self):
+    return self.file.get_line_and_col(self.offset)[1]
+
+  @property
+  def path(self):
+    return self.file.path
+
+class Token:
+  # the lexer produces millions of tokens for big sources,
+  # so they don't carry a `__dict__` as the other nodes do
+  __slots__ = ('kind', 'indent', 'is_on_new_line', 'value', 'pos')
+
+  def __init__(self, kind, indent, is_on_new_line, value, pos):
+    self.kind = kind
+    self.indent = indent
+    self.is_on_new_line = is_on_new_line
+    self.value = value
+    self.pos = pos
+
+  def __reduce__(self):
+    return Token, (self.kind, self.indent, self.is_on_new_line, self.value, self.pos)
+
+  @property
+  def evaluate_fn_name(self):
+    return f'evaluate_{self.kind}'
+
+  __repr__ = Node.__repr__
+
 class MappedAst:
-  def __init__(self):
+  # a scope only holds the symbols declared in it and looks up
+  # the other ones in the scopes it is nested in
+  def __init__(self, parent=None):
     self.symbols = {}
+    self.parent = parent
   
-  def copy(self):
-    m = MappedAst()
-    m.symbols = self.symbols.copy()
+  def find_symbol(self, id):
+    m = self
 
-    return m
+    while m is not None:
+      if (sym := m.symbols.get(id)) is not None:
+        return sym
+
+      m = m.parent
+
+    return None
   
   def declare_symbol(self, id, sym, pos):
     from gen import BUILTINS_TABLE
@@ -190,19 +371,20 @@ class MappedAst:
     if id in BUILTINS_TABLE:
       error(f'id `{id}` is reserved')
 
-    if id in self.symbols:
+    # ids of the outer scopes can't be shadowed
+    if self.is_declared(id):
       error(f'id `{id}` already declared', pos)
     
     self.symbols[id] = sym
   
   def is_declared(self, id):
-    return id in self.symbols
+    return self.find_symbol(id) is not None
   
   def get_symbol(self, id, pos):
-    if id not in self.symbols:
+    if (sym := self.find_symbol(id)) is None:
       error(f'id `{id}` not declared', pos)
 
-    return self.symbols[id]
+    return sym
   
   def __repr__(self):
     r = ''
@@ -296,24 +478,68 @@ class RealType:
     return self.kind == 'struct_rt'
   
   def calculate_size(self):
-    if self.is_numeric():
-      return self.bits // 8
+    return self.calculate_layout()[0]
 
+  def calculate_layout(self):
+    # the size and alignment the llvm data layout of x86_64 gives to the lowered type,
+    # the size already includes the padding at the end, so that it is the distance
+    # between two elements of an array of this type
+    if self.is_numeric():
+      size = self.bits // 8
+      return size, size
+    
     match self.kind:
       case 'ptr_rt':
-        return 8 # todo: return the size of the target arch
+        return 8, 8 # todo: return the size of the target arch
       
       case 'struct_rt':
-        return max(map(lambda k: self.fields[k].calculate_size(), self.fields)) * len(self.fields)
+        size, align, _ = self.calculate_struct_layout()
+        return size, align
 
       case 'union_rt':
-        return max(map(lambda k: self.fields[k].calculate_size(), self.fields))
+        # lowered to an integer as wide as its biggest field, which is aligned
+        # as the smallest integer of the data layout that can contain it
+        width = self.calculate_union_width()
+        align = next((a for a in [1, 2, 4, 8] if width <= a), 16)
+        return align_to(width, align), align
       
-      case 'static_array_rt' | 'static_vector_rt':
-        return self.type.calculate_size() * self.length
+      case 'static_array_rt':
+        size, align = self.type.calculate_layout()
+        return size * self.length, align
+
+      case 'static_vector_rt':
+        # vectors are aligned to their size, rounded up to a power of two
+        size = self.type.calculate_size() * self.length
+        align = 1 << max(size - 1, 0).bit_length()
+        return align_to(size, align), align
 
       case _:
         raise NotImplementedError()
+
+  def calculate_struct_layout(self, fields=None):
+    # each field is placed at the first offset aligned to its alignment, the struct is aligned
+    # as its most aligned field, the fields are the ones of the type unless others are given
+    fields = self.fields if fields is None else fields
+    offsets = {}
+    size = 0
+    align = 1
+
+    for name, rt in fields.items():
+      field_size, field_align = rt.calculate_layout()
+      offsets[name] = size = align_to(size, field_align)
+      size += field_size
+      align = max(align, field_align)
+    
+    return align_to(size, align), align, offsets
+
+  def calculate_union_width(self):
+    return max(map(lambda k: self.fields[k].calculate_size(), self.fields))
+
+  def get_reordered_fields(self):
+    # sorting the fields by decreasing alignment leaves padding only at the end, since
+    # every size is a multiple of its alignment and every alignment is a power of two,
+    # fields with the same alignment keep the order they are declared in
+    return dict(sorted(self.fields.items(), key=lambda field: -field[1].calculate_layout()[1]))
   
   def is_valid_realtype(self):
     return self.kind not in ['placeholder_rt', 'generic_to_infer_rt']
@@ -368,7 +594,7 @@ class RealType:
           return self.length == obj.length and self.type.internal_eq(obj.type, in_progress_struct_rt_ids)
 
         case _:
-          return equal_dicts(self.__dict__, obj.__dict__, ['aka'])
+          return equal_dicts(self.__dict__, obj.__dict__, ['aka', 'type_id'])
     
     if self.kind != obj.kind:
       return False
@@ -382,7 +608,176 @@ class RealType:
     
     return True
 
+  def get_local_items(self):
+    # what `internal_eq` compares besides the inner types
+    match self.kind:
+      case 'ptr_rt':
+        return [self.is_mut]
+
+      case 'static_array_rt' | 'static_vector_rt':
+        return [self.length]
+
+      case 'struct_rt' | 'union_rt':
+        return [tuple(self.fields)]
+
+      case 'fn_rt':
+        return []
+
+      case _:
+        return sorted((name, value) for name, value in self.__dict__.items() if name not in ['kind', 'aka', 'type_id'])
+
+  def get_structural_key(self, in_progress_rt_ids):
+    # the same fields `internal_eq` compares, with the ids of the inner types
+    items = [rt.get_structural_type_id(in_progress_rt_ids) for rt in self.get_inner_types()]
+
+    if None in items:
+      return None
+
+    return (self.kind, *self.get_local_items(), *items)
+
+  def get_type_id(self, in_progress_rt_ids=()):
+    # every structurally distinct type gets an id in the type table of the build, see
+    # `utils.setup_globals`, the ids given by the previous builds of a `zpp serve` are stale
+    if (type_id := self.__dict__.get('type_id')) is not None and type_id[0] == utils.build_generation:
+      return type_id[1]
+
+    # placeholders still change when the type they stand for is evaluated and generics to infer
+    # compare equal to any type, so these, and the types containing them, are compared with
+    # `internal_eq` instead
+    if not self.is_valid_realtype() or id(self) in in_progress_rt_ids:
+      return None
+
+    key = self.get_structural_key(in_progress_rt_ids + (id(self),))
+
+    # recursive types compare equal when they unroll the same way, so the types
+    # that contain them are keyed by the whole of them instead of their inner types
+    if is_canonical := key is None:
+      key = self.get_canonical_key()
+
+    if key is None:
+      return None
+
+    type_id = utils.realtype_ids.setdefault(key, len(utils.realtype_ids))
+    self.type_id = (utils.build_generation, type_id, is_canonical)
+
+    return type_id
+
+  def get_structural_type_id(self, in_progress_rt_ids):
+    # the id of an inner type when it can stand for it in the structural key of the outer one
+    if (type_id := self.get_type_id(in_progress_rt_ids)) is None or self.type_id[2]:
+      return None
+
+    return type_id
+
+  def get_inner_types(self):
+    match self.kind:
+      case 'ptr_rt' | 'static_array_rt' | 'static_vector_rt':
+        return [self.type]
+
+      case 'struct_rt' | 'union_rt':
+        return list(self.fields.values())
+
+      case 'fn_rt':
+        return self.arg_types + [self.ret_type]
+
+      case _:
+        return []
+
+  def get_unrolling_classes(self):
+    # the class of each type reachable from this one, by its `__dict__`, since a resolved placeholder
+    # shares it with the type it stands for, the types in the same class unroll the same way, so they
+    # compare equal, None when a type is not valid
+    rts = {}
+    to_visit = [self]
+
+    while len(to_visit) > 0:
+      rt = to_visit.pop()
+
+      if id(rt.__dict__) in rts:
+        continue
+
+      if not rt.is_valid_realtype():
+        return None
+
+      rts[id(rt.__dict__)] = rt
+      to_visit.extend(rt.get_inner_types())
+
+    # the types are split by what they compare, then by the classes of their
+    # inner types, until no class is split anymore
+    classes = {rt_id: (rt.kind, *rt.get_local_items()) for rt_id, rt in rts.items()}
+    classes_count = 0
+
+    while len(set(classes.values())) > classes_count:
+      classes_count = len(set(classes.values()))
+      signatures = {rt_id: (classes[rt_id], *[classes[id(inner_rt.__dict__)] for inner_rt in rt.get_inner_types()]) for rt_id, rt in rts.items()}
+      class_ids = {}
+      classes = {rt_id: class_ids.setdefault(signature, len(class_ids)) for rt_id, signature in signatures.items()}
+
+    return classes
+
+  def get_canonical_key(self):
+    # the lowering key of the type, once the inner types that unroll the same way
+    # are merged, so that every instance of a recursive type, unrolled or not, has
+    # the same key, the same in every process
+    if (classes := self.get_unrolling_classes()) is None:
+      return None
+
+    return self.get_class_key(classes)
+
+  def get_class_key(self, classes, in_progress_classes=()):
+    if (rt_class := classes[id(self.__dict__)]) in in_progress_classes:
+      return ('outer', len(in_progress_classes) - in_progress_classes.index(rt_class))
+
+    in_progress_classes += (rt_class,)
+    return (self.kind, *self.get_local_items(), *[rt.get_class_key(classes, in_progress_classes) for rt in self.get_inner_types()])
+
+  def is_recursive(self):
+    # whether the type contains itself, or a type that unrolls the same way it does
+    if (classes := self.get_unrolling_classes()) is None:
+      return False
+
+    to_visit = self.get_inner_types()
+    visited = set()
+
+    while len(to_visit) > 0:
+      rt = to_visit.pop()
+
+      if classes[id(rt.__dict__)] == classes[id(self.__dict__)]:
+        return True
+
+      if id(rt.__dict__) not in visited:
+        visited.add(id(rt.__dict__))
+        to_visit.extend(rt.get_inner_types())
+
+    return False
+
+  def get_lowering_key(self, in_progress_rt_ids=(), use_type_ids=True):
+    # the type id, or for the types that contain recursive ones a description where
+    # every reference to an outer type is counted from the innermost one, so that
+    # the same recursive type has the same key whatever instance it is reached by,
+    # without `use_type_ids` the whole type is described, since the ids depend on
+    # the order the build reaches the types in
+    if use_type_ids and (type_id := self.get_type_id()) is not None:
+      return type_id
+
+    if id(self.__dict__) in in_progress_rt_ids:
+      return ('outer', len(in_progress_rt_ids) - in_progress_rt_ids.index(id(self.__dict__)))
+
+    if not self.is_valid_realtype():
+      return None
+
+    in_progress_rt_ids += (id(self.__dict__),)
+    items = [rt.get_lowering_key(in_progress_rt_ids, use_type_ids) for rt in self.get_inner_types()]
+
+    if None in items:
+      return None
+
+    return (self.kind, *self.get_local_items(), *items)
+
   def __eq__(self, obj):
+    if isinstance(obj, RealType) and (self_id := self.get_type_id()) is not None and (obj_id := obj.get_type_id()) is not None:
+      return self_id == obj_id
+
     return self.internal_eq(obj)
 
   def internal_repr(self, in_progress_struct_rt_ids=[]):
@@ -467,45 +862,83 @@ class RealData:
   def __repr__(self):
     return f'<repr RealData {self.__dict__}>'
 
-class ComparatorDict:
+class InstantiationCache:
+  # maps the keys of the functions and types being generated (the id of their symbol with
+  # the realtypes of their generic args) to what was generated, the keys are hashed with the
+  # ids of their types in the type table, the keys with types that have no id (such as the ones
+  # with generics to infer) are compared with `==` to every other key, as they can match any of them
   def __init__(self):
-    self.items = []
-  
+    self.items = {}
+    # (key, entry key in `self.items`) of the keys that can't be hashed
+    self.unhashable_keys = []
+
   def values(self):
-    return [v for _, v in self.items]
+    return [v for _, v in self.items.values()]
 
   def keys(self):
-    return [k for k, _ in self.items]
+    return [k for k, _ in self.items.values()]
+
+  def find_entry_key(self, key):
+    utils.counters['instantiation_cache_lookups'] += 1
+    entry_key = get_instantiation_fingerprint(key)
+
+    if entry_key is not None:
+      if entry_key in self.items:
+        return entry_key
+
+      candidates = self.unhashable_keys
+    else:
+      candidates = [(k, ek) for ek, (k, _) in self.items.items()]
+
+    for k, ek in candidates:
+      utils.counters['instantiation_cache_comparisons'] += 1
 
-  def __setitem__(self, key, value):
-    for i, (k, _) in enumerate(self.items):
       if k == key:
-        self.items[i] = (key, value)
-        return
+        return ek
+
+    return None
 
-    self.items.append((key, value))
+  def get(self, key, default=None):
+    entry_key = self.find_entry_key(key)
+    return self.items[entry_key][1] if entry_key is not None else default
+
+  def __setitem__(self, key, value):
+    if (entry_key := self.find_entry_key(key)) is None:
+      if (entry_key := get_instantiation_fingerprint(key)) is None:
+        entry_key = object()
+        self.unhashable_keys.append((key, entry_key))
+
+    self.items[entry_key] = (key, value)
 
   def __getitem__(self, key):
-    for k, v in self.items:
-      if k == key:
-        return v
+    if (entry_key := self.find_entry_key(key)) is None:
+      raise KeyError
 
-    raise KeyError
+    return self.items[entry_key][1]
   
   def __contains__(self, key):
-    for k, _ in self.items:
-      if k == key:
-        return True
-
-    return False
+    return self.find_entry_key(key) is not None
   
   def __len__(self):
     return len(self.items)
 
   def remove_by_key(self, key):
-    for i, (k, _) in enumerate(self.items):
-      if k == key:
-        self.items.pop(i)
-        return
+    if (entry_key := self.find_entry_key(key)) is None:
+      raise KeyError
+
+    del self.items[entry_key]
+    self.unhashable_keys = [(k, ek) for k, ek in self.unhashable_keys if ek is not entry_key]
+
+def get_instantiation_fingerprint(key):
+  # the same for two keys when they compare equal, None when the key can't be hashed
+  match key:
+    case RealType():
+      type_id = key.get_type_id()
+      return ('rt', type_id) if type_id is not None else None
+
+    case tuple() | list():
+      items = tuple(map(get_instantiation_fingerprint, key))
+      return None if None in items else (type(key), items)
 
-    raise KeyError
+    case _:
+      return key
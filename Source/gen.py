@@ -1,13 +1,19 @@
 from copy import copy, deepcopy
-from data import ComparatorDict, MappedAst, Node, Proto, RealData, RealType, Symbol
+from hashlib import sha256
+from layout import record_lowered_layout
+from data import InstantiationCache, MappedAst, Node, Proto, RealData, RealType, Symbol
 from mapast import get_full_path_from_brother_file
+from phases import phase
 from utils import *
 import llvmlite.ir as ll
+import re
 
 import utils
 
 MAIN_FN_IDENTIFIER = 'main'
 ENTRY_FN_IDENTIFIER = 'main'
+# the references to globals in the text of llvm constants, `@name` or `@"name"`
+GLOBAL_REFERENCE_REGEX = re.compile(r'@(?:"(?:[^"\\]|\\.)*"|[-a-zA-Z$._0-9]+)')
 
 REALTYPE_PLACEHOLDER = RealType('placeholder_rt')
 REALTYPE_RESULT = RealType('i32_rt', aka='Result')
@@ -42,14 +48,28 @@ class Generator:
     self.path = path
     self.maps = [map]
     self.imports = imports
-    self.output = utils.output
     self.libs_to_import = utils.libs_to_import
-    self.llvm_internal_functions_cache = utils.llvm_internal_functions_cache
-    self.strings = utils.strings_cache
     self.llvm_internal_vars_cache = utils.llvm_internal_vars_cache
-    self.fn_in_evaluation = ComparatorDict()
-    self.fn_evaluated = ComparatorDict()
-    self.namedtypes_in_evaluation = ComparatorDict()
+
+    if is_incremental_build():
+      # each module is lowered into its own llvm module, so that it can be compiled into a
+      # separate object file, with its own context, so that its ir only declares the named
+      # structs it uses, see `declare_external_references` for the ones of other modules
+      self.llvm_context = ll.Context()
+      self.output = ll.Module(context=self.llvm_context)
+      self.llvm_types_cache = {}
+      self.llvm_internal_functions_cache = {}
+      self.strings = {}
+    else:
+      self.llvm_context = utils.llvm_context
+      self.output = utils.output
+      self.llvm_types_cache = utils.llvm_types_cache
+      self.llvm_internal_functions_cache = utils.llvm_internal_functions_cache
+      self.strings = utils.strings_cache
+
+    self.fn_in_evaluation = InstantiationCache()
+    self.fn_evaluated = InstantiationCache()
+    self.namedtypes_in_evaluation = InstantiationCache()
     self.llvm_builders = [] # the last one is the builder in use
     self.ctx_types = []
     self.loops = []
@@ -59,6 +79,9 @@ class Generator:
     self.defer_stmts = []
     self.generic_ids_to_infer = []
     self.setupper_llvmfn = None
+    # built from `self.imports` on the first lookup, see `get_imports_table`
+    self.imported_ids = None
+    self.imported_all_modules = None
   
   @property
   def defer_nodes(self):
@@ -100,52 +123,57 @@ class Generator:
   def inside_loop(self):
     return len(self.loop) > 0
   
-  def get_symbol(self, id, pos):
-    for path_of_imp, ids in self.imports.items():
+  def build_imports_table(self):
+    # alias -> (import order, module path, real id, pos of the id in the import),
+    # the modules imported with all their ids are looked up in order, since their
+    # symbols are only known once they are mapped
+    self.imported_ids = {}
+    self.imported_all_modules = []
+
+    for order, (path_of_imp, ids) in enumerate(self.imports.items()):
       # when all symbols are imported
       if has_to_import_all_ids(ids):
-        if not utils.cache[path_of_imp].base_map.is_declared(id):
-          continue
-        
-        return utils.cache[path_of_imp].base_map.get_symbol(id, pos)
+        self.imported_all_modules.append((order, path_of_imp, ids.pos))
+        continue
 
       # mapping ids to their aliases
-      if id in (id_aliases := list(map(lambda i: i[1], ids))):
-        real_id = list(map(lambda i: i[0], ids))[id_aliases.index(id)]
-        return utils.cache[path_of_imp].base_map.get_symbol(real_id, pos)
+      for real_id, alias, pos in ids:
+        self.imported_ids.setdefault(alias, (order, path_of_imp, real_id, pos))
 
-    return self.map.get_symbol(id, pos)
+  def get_import_of(self, id):
+    # the first import that makes `id` visible, as (module path, real id, pos of the import, whether
+    # all ids of the module are imported), the same one the imports would give when looked up in order
+    if self.imported_ids is None:
+      self.build_imports_table()
 
-  def declare_symbol(self, id, sym, pos):
-    for path_of_imp, ids in self.imports.items():
-      # when all symbols are imported
-      if has_to_import_all_ids(ids):
-        if utils.cache[path_of_imp].base_map.is_declared(id):
-          error(f'id `{id}` already declared (from import at {repr_pos(ids.pos)})', pos)
+    imported_id = self.imported_ids.get(id)
 
-        continue
+    for order, path_of_imp, pos in self.imported_all_modules:
+      if imported_id is not None and order > imported_id[0]:
+        break
 
-      # mapping ids to their aliases
-      if id in (id_aliases := list(map(lambda i: i[1], ids))):
-        pos = ids[id_aliases.index(id)][2]
-        error(f'id `{id}` already declared (from import at {repr_pos(pos)})', pos)
+      if utils.cache[path_of_imp].base_map.is_declared(id):
+        return path_of_imp, id, pos, True
+
+    return (*imported_id[1:], False) if imported_id is not None else None
+
+  def get_symbol(self, id, pos):
+    if (imp := self.get_import_of(id)) is not None:
+      path_of_imp, real_id, _, _ = imp
+      return utils.cache[path_of_imp].base_map.get_symbol(real_id, pos)
+
+    return self.map.get_symbol(id, pos)
+
+  def declare_symbol(self, id, sym, pos):
+    if (imp := self.get_import_of(id)) is not None:
+      _, _, import_pos, is_imported_with_all = imp
+      # an id imported explicitly is reported at the import
+      error(f'id `{id}` already declared (from import at {repr_pos(import_pos)})', pos if is_imported_with_all else import_pos)
 
     self.map.declare_symbol(id, sym, pos)
   
   def is_declared(self, id):
-    for path_of_imp, ids in self.imports.items():
-      # when all symbols are imported
-      if has_to_import_all_ids(ids):
-        if utils.cache[path_of_imp].base_map.is_declared(id):
-          return True
-        
-        continue
-
-      # mapping ids to their aliases
-      if id in map(lambda i: i[1], ids):
-        return True
-
-    return self.map.is_declared(id)
+    return self.get_import_of(id) is not None or self.map.is_declared(id)
   
   def get_list_of_all_global_symbol_ids(self):
     r = list(self.base_map.symbols.keys())
@@ -183,8 +211,8 @@ class Generator:
 
     key = id(sym)
 
-    if key in self.namedtypes_in_evaluation:
-      return self.namedtypes_in_evaluation[key]
+    if (r := self.namedtypes_in_evaluation.get(key)) is not None:
+      return r
 
     r = self.namedtypes_in_evaluation[key] = RealType('placeholder_rt')
     realtype = self.evaluate_type(sym.node.type, is_top_call=False)
@@ -211,8 +239,8 @@ class Generator:
   def internal_evaluate_named_generic_type(self, generic_type_node, sym, generics_rt):
     key = (id(sym), generics_rt)
 
-    if key in self.namedtypes_in_evaluation:
-      return self.namedtypes_in_evaluation[key]
+    if (r := self.namedtypes_in_evaluation.get(key)) is not None:
+      return r
 
     r = self.namedtypes_in_evaluation[key] = RealType('placeholder_rt')
 
@@ -302,6 +330,12 @@ class Generator:
                 for field in type_node.fields
           }
         )
+
+        if type_node.is_reordered:
+          # the fields are kept in the order of the layout, so that the llvm struct
+          # and the indexes of the fields follow it
+          r.fields = r.get_reordered_fields()
+          r.is_reordered = True
       
       case 'fn_type_node':
         if not allow_fn_type:
@@ -391,7 +425,7 @@ class Generator:
     if new_ctx is not None:
       self.push_ctx(new_ctx)
     
-    t = getattr(self, f'evaluate_{node.kind}')(node)
+    t = getattr(self, node.evaluate_fn_name)(node)
 
     if new_ctx is not None:
       self.pop_ctx()
@@ -995,19 +1029,30 @@ class Generator:
   
   def evaluate_struct_init_node(self, init_node):
     field_names = list(map(lambda field: field.name.value, init_node.fields))
-    ctx_realtypes = list(self.ctx.fields.values()) if self.ctx.is_struct() else []
+    ctx_fields = self.ctx.fields if self.ctx.is_struct() else {}
+    # the fields of a reordered struct are written in the order they are declared in,
+    # they are matched by name and then placed in the order of its layout
+    is_reordered = getattr(self.ctx, 'is_reordered', False) and sorted(field_names) == sorted(ctx_fields)
+    ctx_realtypes = [ctx_fields[name] for name in field_names] if is_reordered else list(ctx_fields.values())
     field_realdatas = [self.evaluate_node(field.expr, ctx_realtypes[i] if i < len(ctx_realtypes) else REALTYPE_PLACEHOLDER) for i, field in enumerate(init_node.fields)]
-    field_realtypes = map(lambda realdata: realdata.realtype, field_realdatas)
+    field_positions = [field.name.pos for field in init_node.fields]
 
     for i, field_name in enumerate(field_names):
       if field_names.count(field_name) > 1:
         error(f'field `{field_name}` is dupplicate', init_node.fields[i].name.pos)
+
+    if is_reordered:
+      order = [field_names.index(name) for name in ctx_fields]
+      field_names, field_realdatas, field_positions = (
+        [field_names[i] for i in order], [field_realdatas[i] for i in order], [field_positions[i] for i in order]
+      )
     
+    field_realtypes = map(lambda realdata: realdata.realtype, field_realdatas)
     realtype = RealType('struct_rt', fields=dict(zip(field_names, field_realtypes)))
     llvm_data = ll.Constant(self.convert_realtype_to_llvmtype(realtype, pos=init_node.pos), ll.Undefined)
 
     for i, field_realdata in enumerate(field_realdatas):
-      real_expected_value_llvm_type = self.convert_realtype_to_llvmtype(field_realdata.realtype, pos=init_node.fields[i].name.pos)
+      real_expected_value_llvm_type = self.convert_realtype_to_llvmtype(field_realdata.realtype, pos=field_positions[i])
       llvm_data = self.llvm_insert_value(self.cur_builder, llvm_data, field_realdata.llvm_data, i, real_expected_value_llvm_type)
 
     rd = RealData(
@@ -1794,9 +1839,15 @@ class Generator:
     self.expect_args_count(call_node, lambda count: count == 1)
     self.expect_generics_count(call_node, lambda count: count == 0)
   
-    call_node.args.append(Node('num', value='1', pos=call_node.pos))
-
-    return self.evaluate_internal_call_to_expect_or(call_node)
+    # a new node is built instead of appending the argument, since asts may be reused across builds
+    return self.evaluate_internal_call_to_expect_or(Node(
+      'call_node',
+      name=call_node.name,
+      generics=call_node.generics,
+      is_internal_call=call_node.is_internal_call,
+      args=call_node.args + [Node('num', value='1', pos=call_node.pos)],
+      pos=call_node.pos
+    ))
   
   def evaluate_internal_call_to_expect_or(self, call_node):
     self.expect_args_count(call_node, lambda count: count == 2)
@@ -2339,6 +2390,7 @@ class Generator:
   def cache_string(self, string, use_bitcast=True):
     if string not in self.strings:
       self.str_counter += 1
+      utils.counters['strings_cached'] += 1
       llvm_data = self.strings[string] = ll.GlobalVariable(
         self.output,
         t := ll.ArrayType(ll.IntType(8), len(string) + 1),
@@ -2440,6 +2492,37 @@ class Generator:
     )
 
   def convert_realtype_to_llvmtype(self, realtype, in_progress_struct_rd_ids=[], pos=None):
+    # types are lowered once per build, the ones with placeholders are lowered every time
+    if (key := realtype.get_lowering_key()) is None:
+      return self.internal_convert_realtype_to_llvmtype(realtype, in_progress_struct_rd_ids, pos)
+
+    if (llvmtype := self.llvm_types_cache.get(key)) is None:
+      llvmtype = self.lower_and_cache_realtype(realtype, key, in_progress_struct_rd_ids, pos)
+
+    if utils.reporting_layouts and (realtype.is_struct() or realtype.is_union()):
+      record_lowered_layout(realtype, llvmtype)
+
+    return llvmtype
+
+  def lower_and_cache_realtype(self, realtype, key, in_progress_struct_rd_ids, pos):
+    if realtype.is_struct() and realtype.is_recursive():
+      # a recursive struct becomes a named llvm struct, cached before lowering
+      # its fields, so that the references to itself find it
+      llvmtype = self.llvm_types_cache[key] = self.create_named_llvm_struct(realtype)
+      llvmtype.set_body(*[self.convert_realtype_to_llvmtype(rt, pos=pos) for rt in realtype.fields.values()])
+
+      return llvmtype
+
+    llvmtype = self.llvm_types_cache[key] = self.internal_convert_realtype_to_llvmtype(realtype, in_progress_struct_rd_ids, pos)
+    return llvmtype
+
+  def create_named_llvm_struct(self, realtype):
+    # the name only depends on the structure of the type, so that every module of an incremental
+    # build gives the same name to the same struct, and builds of the same code give the same ir
+    digest = sha256(repr(realtype.get_canonical_key()).encode()).hexdigest()[:16]
+    return self.llvm_context.get_identified_type(f"{getattr(realtype, 'aka', 'struct')}.{digest}")
+
+  def internal_convert_realtype_to_llvmtype(self, realtype, in_progress_struct_rd_ids, pos):
     if realtype.is_int():
       return ll.IntType(realtype.bits)
     
@@ -2460,7 +2543,7 @@ class Generator:
         return ll.VoidType()
       
       case 'union_rt':
-        return ll.IntType(realtype.calculate_size() * 8)
+        return ll.IntType(realtype.calculate_union_width() * 8)
       
       case 'static_array_rt':
         return ll.ArrayType(self.convert_realtype_to_llvmtype(realtype.type, in_progress_struct_rd_ids, pos), realtype.length)
@@ -2609,7 +2692,10 @@ class Generator:
       self.fixname_for_llvm(fn_name)
     )
 
-    llvm_fn.linkage = 'private'
+    # functions of other modules are reached through declarations when building incrementally
+    if not is_incremental_build():
+      llvm_fn.linkage = 'private'
+
     return llvm_fn
 
   def push_ctx(self, realtype):
@@ -2727,15 +2813,16 @@ class Generator:
   def gen_nongeneric_fn(self, fn):
     key = id(fn)
 
-    if key in self.fn_in_evaluation:
-      return self.fn_in_evaluation[key]
+    if (r := self.fn_in_evaluation.get(key)) is not None:
+      return r
     
-    if key in self.fn_evaluated:
-      return self.fn_evaluated[key]
+    if (r := self.fn_evaluated.get(key)) is not None:
+      return r
 
     self.push_scope()
 
-    t = self.gen_fn(fn, fn.node.name.value, key)
+    with phase('gen_fn', self.path):
+      t = self.gen_fn(fn, fn.node.name.value, key)
 
     self.pop_scope()
 
@@ -2752,18 +2839,20 @@ class Generator:
   def gen_generic_fn(self, fn, rt_generics):
     key = (id(fn), rt_generics)
 
-    if key in self.fn_in_evaluation:
-      return self.fn_in_evaluation[key]
+    if (r := self.fn_in_evaluation.get(key)) is not None:
+      return r
     
-    if key in self.fn_evaluated:
-      return self.fn_evaluated[key]
+    if (r := self.fn_evaluated.get(key)) is not None:
+      return r
     
     # pushing the scope for the generics
     self.push_scope()
     self.declare_generics(fn.node.generics, rt_generics)
 
     fn_name = f'{fn.node.name.value}<{", ".join(map(repr, rt_generics))}>'
-    r = self.gen_fn(fn, fn_name, key)
+    utils.counters['generic_instantiations'] += 1
+    with phase('gen_fn', self.path):
+      r = self.gen_fn(fn, fn_name, key)
 
     # popping the scope for the generics
     self.pop_scope()
@@ -2771,6 +2860,7 @@ class Generator:
     return r
 
   def gen_fn(self, fn, fn_name, key):
+    utils.counters['functions_generated'] += 1
     proto = self.evaluate_fn_proto(fn.node)
     llvmfn = self.create_llvm_function(fn_name, proto)
   
@@ -2836,11 +2926,11 @@ class Generator:
   
   def push_sub_scope(self):
     self.defer_stmts.append([])
-    self.maps.append(self.maps[-1].copy())
+    self.maps.append(MappedAst(self.map))
   
   def push_scope(self):
     self.defer_stmts.append([])
-    self.maps.append(self.base_map.copy())
+    self.maps.append(MappedAst(self.base_map))
   
   def pop_scope(self):
     self.evaluate_defer_nodes()
@@ -2982,7 +3072,7 @@ def emit_push_trail(g, llvm_builder, llvm_allocas_builder, trail_info):
     inbounds=True
   )
   k = llvm_builder.load(k)
-  k = llvm_builder.bitcast(k, ll.PointerType(ll.IntType(1)))
+  k = llvm_builder.bitcast(k, trail_llvmtype.elements[1])
 
   a = ll.Constant(trail_llvmtype, ll.Undefined)
   b = llvm_builder.insert_value(a, llvm_trail_info_cstring, 0)
@@ -3004,8 +3094,109 @@ def emit_pop_trail(llvm_builder):
   trace_pop_llvm_fn = get_llvm_fn_from_intrinsicmod(INTRINSICMOD_TRACE_ZPP, 'trace_pop')
   llvm_builder.call(trace_pop_llvm_fn, [])
 
+def declare_external_reference(llvm_module, value):
+  if value.parent is llvm_module or value.name in llvm_module.globals:
+    return
+
+  if isinstance(value, ll.Function):
+    ll.Function(llvm_module, value.ftype, value.name)
+  else:
+    ll.GlobalVariable(llvm_module, value.value_type, value.name)
+
+def get_global_values_by_reference():
+  return {
+    value.get_reference(): value
+      for g in utils.cache.values()
+        for value in g.output.global_values
+  }
+
+def get_inner_llvmtypes(llvmtype):
+  match llvmtype:
+    case ll.PointerType():
+      return [] if llvmtype.is_opaque else [llvmtype.pointee]
+
+    case ll.ArrayType() | ll.VectorType():
+      return [llvmtype.element]
+
+    case ll.BaseStructType():
+      return list(llvmtype.elements or [])
+
+    case ll.FunctionType():
+      return [llvmtype.return_type, *llvmtype.args]
+
+    case _:
+      return []
+
+def declare_external_named_structs(llvm_module):
+  # every module has its own context, the named structs that reach its code from other modules,
+  # through the declarations of their functions or the values they return, are declared in it
+  # with the same body, they have the same name in every module, see `create_named_llvm_struct`
+  llvmtypes = [llvm_fn.ftype for llvm_fn in llvm_module.functions] + [
+    value.value_type for value in llvm_module.global_values if isinstance(value, ll.GlobalVariable)
+  ]
+
+  for llvm_fn in llvm_module.functions:
+    for block in llvm_fn.blocks:
+      for instr in block.instructions:
+        llvmtypes.append(instr.type)
+        llvmtypes.extend(op.type for op in instr.operands)
+
+  visited = set()
+
+  while len(llvmtypes) > 0:
+    llvmtype = llvmtypes.pop()
+
+    if id(llvmtype) in visited:
+      continue
+
+    visited.add(id(llvmtype))
+
+    if isinstance(llvmtype, ll.IdentifiedStructType) and llvmtype.name not in llvm_module.context.identified_types:
+      llvm_module.context.get_identified_type(llvmtype.name).set_body(*llvmtype.elements)
+
+    llvmtypes.extend(get_inner_llvmtypes(llvmtype))
+
+def declare_external_references(llvm_module):
+  # declares in `llvm_module` every function or global variable used by its code,
+  # or by the initializers of its globals, but defined into another module
+  values = [
+    op
+      for llvm_fn in llvm_module.functions
+        for block in llvm_fn.blocks
+          for instr in block.instructions
+            for op in instr.operands
+  ] + [
+    value.initializer
+      for value in llvm_module.global_values
+        if isinstance(value, ll.GlobalVariable) and value.initializer is not None
+  ]
+  # built only when a constant expression is found
+  global_values_by_reference = None
+
+  while len(values) > 0:
+    value = values.pop()
+
+    if isinstance(value, ll.GlobalValue):
+      declare_external_reference(llvm_module, value)
+    elif isinstance(value, ll.FormattedConstant):
+      # constant expressions, such as a bitcast or a gep of a global,
+      # only keep the text of their operands
+      if global_values_by_reference is None:
+        global_values_by_reference = get_global_values_by_reference()
+
+      for reference in GLOBAL_REFERENCE_REGEX.findall(value.constant):
+        if (referenced_value := global_values_by_reference.get(reference)) is not None:
+          declare_external_reference(llvm_module, referenced_value)
+    elif isinstance(value, ll.Constant) and isinstance(value.constant, (list, tuple)):
+      values.extend(element for element in value.constant if isinstance(element, ll.Value))
+
+  declare_external_named_structs(llvm_module)
+
 def gen_tests(g):
   test_identifiers_and_llvm_fns = {}
+  # generated functions are cached by the id of their symbol,
+  # so the test symbols must stay alive until all tests are generated
+  test_syms = []
 
   for t in g.tests:
     test_identifier = f"test.`{t.desc}`"
@@ -3022,6 +3213,7 @@ def gen_tests(g):
       pos=t.pos,
       is_test=True
     ))
+    test_syms.append(test_sym)
   
     _, llvm_fn, _ = g.gen_nongeneric_fn(test_sym)
 
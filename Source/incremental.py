@@ -0,0 +1,147 @@
+from bisect import bisect_right
+from itertools import chain
+from data import SourceFile
+from lex import RegexLexer
+from parse import Parser
+
+# an editor keeps one of these for each open module and calls `edit` on every change,
+# only the globals touched by the change are lexed and parsed again, the other ones
+# keep their tokens and nodes, which are shifted in place when the change moves them
+class IncrementalModule:
+  def __init__(self, src, path):
+    self.file = SourceFile(src, path)
+    # for each global: the offset where its source starts, its tokens and its node,
+    # the source of a global goes on until the start of the next one
+    self.toks_of_globals = []
+    self.starts, self.toks_of_globals, self.ast, _ = self.parse_region(0, self.lex_region(0, None)[0], 0)
+
+  @property
+  def src(self):
+    return self.file.src
+
+  @property
+  def toks(self):
+    return [tok for toks in self.toks_of_globals for tok in toks]
+
+  def lex_region(self, start, end):
+    lexer = RegexLexer(self.file.src, self.file.path)
+    lexer.file = self.file
+    toks = []
+
+    for tok in lexer.lex_stream(start):
+      if end is not None and tok.pos.offset >= end:
+        # the first token after the region, returned to check the resync
+        return toks, tok
+
+      toks.append(tok)
+
+    return toks, None
+
+  def parse_region(self, start, toks, next_global):
+    # the parser goes on with the tokens of the unchanged globals after the region, so that
+    # it stops or fails exactly as it would on the whole module, when a global of the region
+    # goes on into them, the globals it reaches are parsed again as well
+    p = Parser(chain(toks, *self.toks_of_globals[next_global:]))
+    starts = []
+    toks_of_globals = []
+    ast = []
+    end = len(toks)
+    consumed = 0
+
+    while consumed < end:
+      node = p.parse_next_global()
+
+      if node is None:
+        break
+
+      # the parser drops the tokens of the previous global before parsing the next one,
+      # and the first global keeps the comments and blank lines before it
+      starts.append(start if len(starts) == 0 else p.toks[0].pos.offset)
+      toks_of_globals.append(p.toks[:p.index])
+      ast.append(node)
+      consumed += p.index
+
+      while consumed > end:
+        end += len(self.toks_of_globals[next_global])
+        next_global += 1
+
+    return starts, toks_of_globals, ast, next_global
+
+  def starts_with_global(self, region_toks):
+    return len(region_toks) > 0 and region_toks[0].is_on_new_line and region_toks[0].indent == 0
+
+  def ends_in_sync(self, tok_after, last, delta):
+    if last + 1 == len(self.starts):
+      return True
+
+    # and the lexer must end up where the first token of the next global starts, in the
+    # same state, then all the tokens that follow are the same as before, only shifted
+    old_tok = self.toks_of_globals[last + 1][0]
+
+    return tok_after is not None \
+      and tok_after.pos.offset == old_tok.pos.offset + delta \
+      and tok_after.kind == old_tok.kind \
+      and tok_after.value == old_tok.value \
+      and tok_after.indent == old_tok.indent \
+      and tok_after.is_on_new_line == old_tok.is_on_new_line
+
+  def find_global(self, offset):
+    return max(bisect_right(self.starts, offset) - 1, 0)
+
+  def edit(self, start, end, text):
+    # replaces the source between the offsets `start` and `end` with `text`,
+    # returns the indexes in `self.ast` of the globals that were parsed again
+    delta = len(text) - (end - start)
+    old_src = self.file.src
+
+    if len(self.starts) == 0:
+      first, last = 0, -1
+    else:
+      first = self.find_global(start)
+      last = self.find_global(max(start, end - 1))
+
+    self.file.apply_edit(start, end, text)
+
+    try:
+      # the region grows by one global at a time until it is delimited by unchanged globals
+      while True:
+        region_start = self.starts[first] if first < len(self.starts) else 0
+        region_end = self.starts[last + 1] + delta if last + 1 < len(self.starts) else None
+        toks, tok_after = self.lex_region(region_start, region_end)
+
+        if first > 0 and not self.starts_with_global(toks):
+          first -= 1
+        elif not self.ends_in_sync(tok_after, last, delta):
+          last += 1
+        else:
+          break
+
+      self.shift_globals(last + 1, delta)
+
+      try:
+        starts, toks_of_globals, ast, next_global = self.parse_region(region_start, toks, last + 1)
+      except SystemExit:
+        self.shift_globals(last + 1, -delta)
+        raise
+    except SystemExit:
+      # the module stays as it was before the edit
+      self.file.src = old_src
+      self.file.line_starts = None
+      raise
+
+    self.starts[first:next_global] = starts
+    self.toks_of_globals[first:next_global] = toks_of_globals
+    self.ast[first:next_global] = ast
+
+    # when the globals at the beginning are removed, the next one takes the comments before them
+    if len(self.starts) > 0:
+      self.starts[0] = 0
+
+    return range(first, first + len(ast))
+
+  def shift_globals(self, first, delta):
+    for i in range(first, len(self.starts)):
+      self.starts[i] += delta
+
+      for tok in self.toks_of_globals[i]:
+        tok.pos.offset += delta
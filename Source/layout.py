@@ -0,0 +1,67 @@
+from llvmlite.ir import IdentifiedStructType
+
+import utils
+
+def repr_bytes(count):
+  return f'{count} byte{"" if count == 1 else "s"}'
+
+def get_struct_padding(realtype, fields=None):
+  size, _, _ = realtype.calculate_struct_layout(fields)
+  return size - sum(rt.calculate_size() for rt in (realtype.fields if fields is None else fields).values())
+
+def print_struct_layout(realtype):
+  size, align, offsets = realtype.calculate_struct_layout()
+  end = 0
+
+  print(f'[+] layout of `{realtype}`, {repr_bytes(size)} aligned to {align}, {repr_bytes(get_struct_padding(realtype))} of padding')
+
+  for name, rt in realtype.fields.items():
+    if offsets[name] > end:
+      print(f'  {end:>8}  {"padding":<24} {repr_bytes(offsets[name] - end)}')
+
+    end = offsets[name] + rt.calculate_size()
+    print(f'  {offsets[name]:>8}  {name + ": " + repr(rt):<24} {repr_bytes(rt.calculate_size())}')
+
+  if size > end:
+    print(f'  {end:>8}  {"padding":<24} {repr_bytes(size - end)}')
+
+  # `reorder!(..)` structs are already laid out this way
+  if (reordered_padding := get_struct_padding(realtype, realtype.get_reordered_fields())) < get_struct_padding(realtype):
+    print(f'  declared as `reorder!(..)` it would have {repr_bytes(reordered_padding)} of padding')
+
+def print_union_layout(realtype):
+  size, align = realtype.calculate_layout()
+  width = realtype.calculate_union_width()
+
+  print(f'[+] layout of `{realtype}`, {repr_bytes(size)} aligned to {align}, {repr_bytes(size - width)} of padding')
+
+  for name, rt in realtype.fields.items():
+    print(f'  {0:>8}  {name + ": " + repr(rt):<24} {repr_bytes(rt.calculate_size())}')
+
+def record_lowered_layout(realtype, llvmtype):
+  # the report shows the name of the type when one of its instances has it
+  if not hasattr(utils.lowered_layouts.get(id(llvmtype), (None,))[0], 'aka'):
+    utils.lowered_layouts[id(llvmtype)] = (realtype, llvmtype)
+
+def get_unique_layouts():
+  # the instances of a struct can have different lowering keys, a recursive struct and the literals
+  # with its fields are lowered to a named llvm struct and to a literal one with the same body, so
+  # the layouts are told apart by the fields and the llvm body, and keep the name of the struct
+  unique_layouts = {}
+
+  for realtype, llvmtype in utils.lowered_layouts.values():
+    body = llvmtype.structure_repr() if isinstance(llvmtype, IdentifiedStructType) else str(llvmtype)
+    layout_key = (realtype.is_struct(), tuple(realtype.fields), body)
+
+    if not hasattr(unique_layouts.get(layout_key), 'aka'):
+      unique_layouts[layout_key] = realtype
+
+  return unique_layouts.values()
+
+def report_layouts():
+  # the layouts of the structs and unions the build lowered to llvm, see `RealType.calculate_layout`
+  for realtype in get_unique_layouts():
+    if realtype.is_struct():
+      print_struct_layout(realtype)
+    else:
+      print_union_layout(realtype)
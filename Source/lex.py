@@ -1,5 +1,6 @@
-from data import Node
-from utils import error
+from data import Pos, SourceFile, Token
+from re import VERBOSE, compile as compile_regex
+from utils import error, get_argv_option
 
 SKIPPABLE = [' ', '\n', '\t', '\\']
 DOUBLE_PUNCTUATION = ['==', '->', '..', '+=', '-=', '*=', '!=', '<=', '>=']
@@ -12,16 +13,23 @@ KEYWORDS = [
   'match', 'case', 'cast',
   'ref'
 ]
+KEYWORDS_SET = set(KEYWORDS)
+ESCAPED_CHARS = {
+  'n': '\n',
+  'r': '\r',
+  't': '\t',
+  '0': '\0',
+  "'": "'",
+  '`': '`'
+}
 
 class Lexer:
   def __init__(self, src, path):
     self.src = src
-    self.path = path
+    self.file = SourceFile(src, path)
     self.index = 0
     self.indent = 0
     self.on_new_line = True
-    self.line = 1
-    self.start_line_index = 0
   
   @property
   def has_char(self):
@@ -43,13 +51,9 @@ class Lexer:
   def bck(self):
     return self.src[self.index - 1]
 
-  @property
-  def col(self):
-    return self.index - self.start_line_index + 1
-
   @property
   def cur_pos(self):
-    return (self.line, self.col, self.src, self.path)
+    return Pos(self.file, self.index)
 
   def advance(self, count=1):
     self.index += count
@@ -64,9 +68,7 @@ class Lexer:
 
       match self.cur:
         case '\n':
-          self.line += 1
           self.indent = 0
-          self.start_line_index = self.index + 1
           self.on_new_line = True
 
           is_collecting_inline_comment = False
@@ -88,8 +90,6 @@ class Lexer:
             error('expected token on new line after `\\`', self.cur_pos)
           
           self.indent = 0
-          self.line += 1
-          self.start_line_index = self.index + 1
           self.on_new_line = False
         
         case '\t':
@@ -170,7 +170,7 @@ class Lexer:
   def make_tok(self, kind, **kwargs):
     assert 'pos' in kwargs
 
-    return Node(
+    return Token(
       kind,
       indent=self.consume_indent(),
       is_on_new_line=self.consume_is_on_new_line(),
@@ -189,14 +189,7 @@ class Lexer:
 
   def get_escaped_char_value(self, c):
     try:
-      return {
-        'n': '\n',
-        'r': '\r',
-        't': '\t',
-        '0': '\0',
-        "'": "'",
-        '`': '`'
-      }[c]
+      return ESCAPED_CHARS[c]
     except KeyError:
       error('unknown escaped char', self.cur_pos)
 
@@ -250,9 +243,178 @@ class Lexer:
     self.advance()
     return t
 
-def lex(src, path):
+# `\w` matches exactly the characters for which `isalnum()` is true, plus `_`,
+# while `\d` only matches decimal digits, the other `isdigit()` characters are handled by hand
+MASTER_REGEX = compile_regex(r'''
+  (?P<spaces>[ ]+)
+| (?P<newline>\n)
+| (?P<comment>--[^\n]*)
+| (?P<continuation>\\[ \t]*\n)
+| (?P<backslash>\\)
+| (?P<tab>\t)
+| (?P<num>\d[\d'.]*)
+| (?P<word>\w+)
+| (?P<str_or_chr>['`])
+| (?P<punctuation>==|->|\.\.|\+=|-=|\*=|!=|<=|>=|[\s\S])
+''', VERBOSE)
+
+NUM_REGEX = compile_regex(r"[\d'.]*")
+STR_BODY_REGEXES = {
+  "'": compile_regex(r"(?:[^'\\]|\\[\s\S])*"),
+  '`': compile_regex(r'(?:[^`\\]|\\[\s\S])*')
+}
+ESCAPE_REGEX = compile_regex(r'\\([\s\S])')
+
+class RegexLexer:
+  def __init__(self, src, path):
+    self.src = src
+    self.file = SourceFile(src, path)
+
+  def collect_num(self, index, pos):
+    src = self.src
+    end = NUM_REGEX.match(src, index + 1).end()
+
+    # digits that are not decimal ones are rare enough to be collected one by one
+    while end < len(src) and (src[end].isdigit() or src[end] in ["'", '.']):
+      end = NUM_REGEX.match(src, end + 1).end()
+
+    t = src[index:end]
+    new_t = t.replace("'", '')
+
+    # only the last character is given back to the source
+    if t.endswith('.') or t.endswith("'"):
+      end -= 1
+      new_t = new_t.rstrip(".'")
+
+    try:
+      _ = float(new_t)
+      failed_parsing = False
+    except ValueError:
+      failed_parsing = True
+
+    if (
+        ".'" in new_t or "'." in new_t or "''" in new_t \
+        or new_t.count('.') > 1 or failed_parsing
+    ):
+      error('malformed num', pos)
+
+    return 'fnum' if '.' in new_t else 'num', new_t, end
+
+  def unescape_char(self, match, offset, pos):
+    try:
+      return ESCAPED_CHARS[match.group(1)]
+    except KeyError:
+      error('unknown escaped char', Pos(pos.file, pos.offset + offset + match.start(1)))
+
+  def collect_str_or_chr(self, index, pos):
+    src = self.src
+    apex = src[index]
+    kind = 'str' if apex == "'" else 'chr'
+    end = STR_BODY_REGEXES[apex].match(src, index + 1).end()
+    t = src[index + 1:end]
+
+    if '\\' in t:
+      t = ESCAPE_REGEX.sub(lambda m: self.unescape_char(m, 1, pos), t)
+
+    # the body can only stop before the end, or before a `\` at the end of the source
+    if end >= len(src) or src[end] != apex:
+      error(f'malformed {kind}', pos)
+
+    if kind == 'chr' and len(t) != 1:
+      error('malformed chr (1 character expected)', pos)
+
+    return kind, t, end + 1
+
+  def lex(self):
+    return list(self.lex_stream())
+
+  def lex_stream(self, start=0):
+    # lexing can start at any global, since the lexer has no
+    # state at the beginning of a line with no indentation
+    src = self.src
+    file = self.file
+    match_at = MASTER_REGEX.match
+    src_len = len(src)
+    index = start
+    indent = 0
+    on_new_line = True
+
+    # the state lives in locals, since this loop runs for every token
+    while index < src_len:
+      m = match_at(src, index)
+      kind = m.lastgroup
+      end = m.end()
+
+      if kind == 'spaces':
+        indent += end - index
+        index = end
+        continue
+
+      if kind == 'newline':
+        indent = 0
+        on_new_line = True
+        index = end
+        continue
+
+      if kind == 'comment':
+        index = end
+        continue
+
+      pos = Pos(file, index)
+
+      if kind == 'word':
+        value = m.group()
+
+        if value[0].isdigit():
+          kind, value, end = self.collect_num(index, pos)
+        else:
+          kind = value if value in KEYWORDS_SET else 'id'
+      elif kind == 'punctuation':
+        kind = value = m.group()
+      elif kind == 'num':
+        kind, value, end = self.collect_num(index, pos)
+      elif kind == 'str_or_chr':
+        kind, value, end = self.collect_str_or_chr(index, pos)
+      else:
+        if kind == 'tab':
+          error('tab illegal', pos)
+
+        if on_new_line:
+          error('token `\\` can only be used as last character of the line', pos)
+
+        if kind == 'backslash':
+          while end < src_len and src[end] in [' ', '\t']:
+            end += 1
+
+          error('expected token on new line after `\\`', Pos(file, end))
+
+        # a continuation
+        indent = 0
+        on_new_line = False
+        index = end
+        continue
+
+      yield Token(kind, indent, on_new_line, value, pos)
+
+      indent = 0
+      on_new_line = False
+      index = end
+
+LEXERS = ['classic', 'regex']
+
+def get_lexer_kind():
+  kind = get_argv_option('--lexer', 'classic')
+
+  if kind not in LEXERS:
+    error(f'unknown lexer `{kind}`, expected one of {LEXERS}', None)
+
+  return kind
+
+def lex_classic(src, path):
+  return list(lex_stream_classic(src, path))
+
+def lex_stream_classic(src, path):
   l = Lexer(src, path)
-  r = []
   
   while l.has_char:
     tok = l.gen_next()
@@ -260,6 +422,20 @@ def lex(src, path):
     if tok is None:
       break
 
-    r.append(tok)
-  
-  return r
\ No newline at end of file
+    yield tok
+
+def lex_regex(src, path):
+  return RegexLexer(src, path).lex()
+
+def lex(src, path):
+  if get_lexer_kind() == 'regex':
+    return lex_regex(src, path)
+
+  return lex_classic(src, path)
+
+def lex_stream(src, path):
+  # the tokens are produced one by one, while the parser consumes them
+  if get_lexer_kind() == 'regex':
+    return RegexLexer(src, path).lex_stream()
+
+  return lex_stream_classic(src, path)
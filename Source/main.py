@@ -1,40 +1,139 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
 from genericpath import isdir
-from os import listdir, system
-from subprocess import Popen
-from lex import lex
-from parse import parse
+from hashlib import sha256
+from io import StringIO
+from time import perf_counter
+from os import getpid, listdir, makedirs, remove, replace, system, utime
+from os.path import getmtime
+from subprocess import PIPE, STDOUT, Popen
+from backend import emit_object
+from modcache import get_cache_dir, lex_and_parse
 from mapast import cache_mapast, gen_and_cache_module_setupper
-from gen import gen, gen_tests
-from sys import argv
+from gen import declare_external_references, gen, gen_tests
+from layout import report_layouts
+from phases import phase, report_phases, start_timing_phases
+from profiler import get_profile_path, profile_call
+from sys import argv, stderr
 from utils import *
 from tempfile import gettempdir
 
 import utils
 
-def clang(llvm_ir_filepath, output_filepath, flags=[]):
-  cmd = f'clang -Wno-override-module {" ".join(flags)} {llvm_ir_filepath} -o {output_filepath} {utils.additional_clang_flags} {" ".join(utils.libs_to_import)}'
+# the objects of `--incremental` builds beyond this count are evicted, the least recently used first
+MAX_CACHED_OBJECTS = 1024
+
+def clang(input_filepaths, output_filepath, flags=[]):
+  cmd = f'clang -Wno-override-module {" ".join(flags)} {input_filepaths} -o {output_filepath} {utils.additional_clang_flags} {" ".join(utils.libs_to_import)}'
   # print(f'[+] {cmd}')
   return system(cmd), cmd
 
+def clang_object(llvm_ir_filepath, object_filepath, flags=[]):
+  cmd = f'clang -c -Wno-override-module {" ".join(flags)} {llvm_ir_filepath} -o {object_filepath}'
+  return system(cmd), cmd
+
+def get_opt_level():
+  return 2 if is_release_build() else 0
+
+def compile_modules_to_objects(tmp_folder, clang_flags):
+  # every module is compiled on its own and the object is cached by the hash of its llvm ir,
+  # which already contains the declarations of everything it uses from other modules
+  objects_folder = f'{get_cache_dir()}/objects'
+  object_filepaths = []
+
+  makedirs(objects_folder, exist_ok=True)
+
+  for g in utils.cache.values():
+    with phase('serialize_ir', g.path):
+      llvm_ir = repr(g.output)
+
+    key = sha256(f'{get_backend()}\n{" ".join(clang_flags)}\n{llvm_ir}'.encode()).hexdigest()
+    object_filepath = f'{objects_folder}/{key}.o'
+    object_filepaths.append(object_filepath)
+
+    try:
+      # marks the object as recently used, see `prune_objects_cache`
+      utime(object_filepath)
+      continue
+    except OSError:
+      # not built yet, or evicted by a concurrent build
+      pass
+
+    tmp_object_filepath = f'{object_filepath}.{getpid()}.tmp'
+
+    if get_backend() == 'inprocess':
+      with phase('emit_object', g.path):
+        emit_object(g.output, tmp_object_filepath, get_opt_level())
+    else:
+      # unique to the process as the object, concurrent builds may compile the same module
+      llvm_ir_file = f'{tmp_folder}/{key}.{getpid()}.ll'
+
+      with open(llvm_ir_file, 'w') as f:
+        f.write(llvm_ir)
+
+      with phase('clang', g.path):
+        clang_call = clang_object(llvm_ir_file, tmp_object_filepath, clang_flags)
+
+      remove(llvm_ir_file)
+
+      if clang_call[0] != 0:
+        exitcode, cmd = clang_call
+        error(f'clang error, exitcode: {exitcode}, command: {repr(cmd)}', None)
+
+    replace(tmp_object_filepath, object_filepath)
+
+  prune_objects_cache(objects_folder, object_filepaths)
+  return object_filepaths
+
+def get_last_use(object_filepath):
+  try:
+    return getmtime(object_filepath)
+  except OSError:
+    return 0
+
+def prune_objects_cache(objects_folder, object_filepaths):
+  # every edit of a module leaves a new object, so only the most recently used ones are kept,
+  # the whole cache can also be dropped by removing the `objects` folder of the cache directory
+  in_use = set(object_filepaths)
+  cached = [f'{objects_folder}/{name}' for name in listdir(objects_folder) if name.endswith('.o')]
+
+  if len(cached) <= MAX_CACHED_OBJECTS:
+    return
+
+  cached.sort(key=get_last_use)
+
+  for object_filepath in cached[:len(cached) - MAX_CACHED_OBJECTS]:
+    if object_filepath in in_use:
+      continue
+
+    try:
+      remove(object_filepath)
+    except OSError:
+      # already removed by a concurrent build
+      pass
+
 def compile(path, gen_tests_instead=False):
   path = getabspath(path)
 
   with open(path, 'r') as f:
     src = f.read()
   
-  setup_globals()
+  setup_globals(path)
 
-  toks = lex(src, path)
-  ast = parse(toks)
+  toks, ast = lex_and_parse(src, path)
   g = cache_mapast(path, ast)
-  check_imports_of_all_modules()
+
+  with phase('check_imports'):
+    check_imports_of_all_modules()
 
   gen_and_cache_module_setupper(g)
 
   if gen_tests_instead:
-    gen_tests(g)
+    with phase('gen_tests', path):
+      gen_tests(g)
   else:
-    gen(g)
+    with phase('gen', path):
+      gen(g)
 
   return src, toks, ast, g.map, utils.output, path
 
@@ -76,7 +175,7 @@ def run_tests():
       print('passed')
 '''
 
-def compile_file(srcpath, is_test, has_to_be_runned):
+def build_file(srcpath, is_test, has_to_be_runned):
   _, _, _, _, llvm_ir, path = compile(srcpath, is_test)
   tmp_folder = fixpath(gettempdir())
   llvm_ir_file = f'{tmp_folder}/{get_filename_from_path(path)}.ll'
@@ -92,48 +191,136 @@ def compile_file(srcpath, is_test, has_to_be_runned):
   else:
     output_filepath = change_extension_of_path(path, 'exe')
 
-  with open(llvm_ir_file, 'w') as f:
-    f.write(repr(llvm_ir))
-  
-  if '--print-llvm-ir' in argv:
-    print(llvm_ir)
-  
-  if '--emit-llvm-ir' in argv:
-    assert not is_test and not has_to_be_runned
+  if is_incremental_build():
+    if '--emit-llvm-ir' in argv:
+      error('`--emit-llvm-ir` is not supported by incremental builds', None)
 
-    with open(change_extension_of_path(output_filepath, 'll'), 'w') as f:
-      f.write(repr(llvm_ir))
+    for g in utils.cache.values():
+      with phase('declare_externals', g.path):
+        declare_external_references(g.output)
 
-    return
-  
-  if '--no-exe' in argv:
-    return
+      if '--print-llvm-ir' in argv:
+        print(g.output)
+
+    if '--no-exe' in argv:
+      return path, None
+
+    link_inputs = ' '.join(compile_modules_to_objects(tmp_folder, clang_flags))
+  else:
+    if get_backend() == 'clang':
+      with phase('serialize_ir'):
+        llvm_ir_text = repr(llvm_ir)
+
+      with open(llvm_ir_file, 'w') as f:
+        f.write(llvm_ir_text)
+    
+    if '--print-llvm-ir' in argv:
+      print(llvm_ir)
+    
+    if '--emit-llvm-ir' in argv:
+      assert not is_test and not has_to_be_runned
+
+      with open(change_extension_of_path(output_filepath, 'll'), 'w') as f:
+        f.write(repr(llvm_ir))
+
+      return path, None
+    
+    if '--no-exe' in argv:
+      return path, None
+
+    if get_backend() == 'inprocess':
+      link_inputs = change_extension_of_path(llvm_ir_file, 'o')
+
+      with phase('emit_object'):
+        emit_object(llvm_ir, link_inputs, get_opt_level())
+    else:
+      link_inputs = llvm_ir_file
   
-  if (clang_call := clang(llvm_ir_file, output_filepath, clang_flags))[0] != 0:
+  with phase('clang'):
+    clang_call = clang(link_inputs, output_filepath, clang_flags)
+
+  if clang_call[0] != 0:
     exitcode, cmd = clang_call
     error(f'clang error, exitcode: {exitcode}, command: {repr(cmd)}', None)
   
-  if has_to_be_runned:
+  return path, output_filepath
+
+def compile_file(srcpath, is_test, has_to_be_runned, capture_output=False):
+  start_timing_phases()
+  start = perf_counter()
+  path, output_filepath = build_file(srcpath, is_test, has_to_be_runned)
+
+  if utils.reporting_layouts:
+    report_layouts()
+
+  if utils.time_phases:
+    report_phases(path, perf_counter() - start)
+
+  if has_to_be_runned and output_filepath is not None:
     try:
       args = argv[argv.index('--') + 1:]
     except ValueError:
       args = []
     
+    popen_kwargs = { 'stdout': PIPE, 'stderr': STDOUT } if capture_output else {}
+
     try:
-      with Popen([output_filepath] + args) as p:
-        result = p.wait()
+      with Popen([output_filepath] + args, **popen_kwargs) as p:
+        output, _ = p.communicate()
+        result = p.returncode
     except KeyboardInterrupt:
       exit(1)
 
+    if output is not None:
+      print(output.decode(errors='replace'), end='')
+
     if is_test and (exitcode := result) != 0:
       error(f'test executable expected to have `exitcode = 0`, got `{exitcode}`', None)
     
     return result
 
 def collect_zpp_files_in_dir(path):
-  return [f'{path}/{elem}' for elem in listdir(path) if elem.endswith('.zpp')]
+  return [f'{path}/{elem}' for elem in sorted(listdir(path)) if elem.endswith('.zpp')]
+
+def compile_test_file_captured(file):
+  # runs in a worker process, the output is given back to the main process
+  # so that it can be printed in the same order of the serial loop
+  stdout = StringIO()
+  message = None
+
+  with redirect_stdout(stdout):
+    try:
+      compile_file(file, True, True, capture_output=True)
+      exitcode = 0
+    except SystemExit as e:
+      exitcode = e.code if isinstance(e.code, int) else 1
+      message = e.code if isinstance(e.code, str) else None
+
+  return stdout.getvalue(), message, exitcode
+
+def run_tests_in_parallel(files, jobs):
+  failed_files_count = 0
+
+  with ProcessPoolExecutor(max_workers=jobs) as executor:
+    for output, message, file_exitcode in executor.map(compile_test_file_captured, files):
+      print(output, end='', flush=True)
+
+      if message is not None:
+        print(message, file=stderr, flush=True)
+
+      if file_exitcode != 0:
+        failed_files_count += 1
+
+  if failed_files_count > 0:
+    error(f'{failed_files_count} of {len(files)} test files failed', None)
+
+  return 0
 
 def main():
+  if argv[1] == 'serve':
+    from server import serve
+    return serve(run)
+
   if argv[1] == 'build':
     return compile_file('Main.zpp', False, False)
 
@@ -146,15 +333,24 @@ def main():
     srcpath = argv[2]
   files = collect_zpp_files_in_dir(srcpath) if isdir(srcpath) and argv[1] == 'test' else [srcpath]
   
+  if argv[1] == 'test' and (jobs := get_jobs()) > 1:
+    return run_tests_in_parallel(files, jobs)
+
   for file in files:
     r = compile_file(file, argv[1] == 'test', True)
   
   return r
 
-if __name__ == '__main__':
-  r = main()
+def run():
+  if (profile_path := get_profile_path()) is not None:
+    r = profile_call(main, profile_path)
+  else:
+    r = main()
 
   if '--print-exit-code' in argv:
     print(f'\nExitCode({r})\n')
 
-  exit(r)
\ No newline at end of file
+  return r
+
+if __name__ == '__main__':
+  exit(run())
\ No newline at end of file
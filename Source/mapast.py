@@ -1,7 +1,10 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from data import MappedAst, Node, Symbol
-from lex import lex
-from parse import parse
-from utils import error, fixpath, getabspath, var_is_comptime, get_full_path_from_brother_file
+from modcache import lex_and_parse, lex_and_parse_captured, loaded_modules, preloaded_modules
+from multiprocessing import parent_process
+from phases import phase
+from utils import error, fixpath, getabspath, var_is_comptime, get_full_path_from_brother_file, get_jobs
 
 import utils
 
@@ -11,22 +14,23 @@ def cache_mapast(path, ast):
   path = getabspath(path)
 
   if path not in utils.cache:
-    g = Generator(None, None, None)
-    m, import_nodes, test_nodes = mapast_except_imports(ast, g)
-    paths = list(map(
-      lambda import_node: get_full_path_from_brother_file(path, import_node.path.value),
-      import_nodes
-    ))
-
-    for i, p in enumerate(paths):
-      if paths.count(p) > 1:
-        error('dupplicate import', import_nodes[i].path.pos)
-
-    imports = {
-      paths[i]: ([
-        (id.name.value, id.alias.value, id.pos) for id in import_node.ids
-      ] if isinstance(import_node.ids, list) else import_node.ids) for i, import_node in enumerate(import_nodes)
-    }
+    with phase('cache_mapast', path):
+      g = Generator(None, None, None)
+      m, import_nodes, test_nodes = mapast_except_imports(ast, g)
+      paths = list(map(
+        lambda import_node: get_full_path_from_brother_file(path, import_node.path.value),
+        import_nodes
+      ))
+
+      for i, p in enumerate(paths):
+        if paths.count(p) > 1:
+          error('dupplicate import', import_nodes[i].path.pos)
+
+      imports = {
+        paths[i]: ([
+          (id.name.value, id.alias.value, id.pos) for id in import_node.ids
+        ] if isinstance(import_node.ids, list) else import_node.ids) for i, import_node in enumerate(import_nodes)
+      }
 
     g.maps, g.imports, g.path, g.tests = [m], imports, path, test_nodes
     utils.cache[path] = g
@@ -87,13 +91,78 @@ def mapast_imports(import_nodes, srcpath):
     except OSError:
       error(f'file not found (`{path}`)', glob.path.pos)
     
-    toks = lex(src, path)
-    ast = parse(toks)
+    _, ast = lex_and_parse(src, path)
     g = cache_mapast(path, ast)
 
     gen_and_cache_module_setupper(g)
 
+def get_import_paths(path, ast):
+  return [
+    get_full_path_from_brother_file(path, glob.path.value)
+      for glob in ast if glob.kind == 'import_node'
+  ]
+
+def preload_modules(paths):
+  # lexes and parses the whole import graph in worker processes, breadth first, so that
+  # modules that don't depend on each other are loaded at the same time, the mapping then
+  # goes on in the usual order and finds the asts of the modules already there
+  jobs = get_jobs()
+
+  # the test files compiled in parallel are already in worker processes
+  if jobs == 1 or parent_process() is not None:
+    return
+
+  seen = set(paths)
+  pending = {}
+
+  with phase('preload_modules'), ProcessPoolExecutor(max_workers=jobs, initializer=utils.setup_worker_globals) as executor:
+    def load(path):
+      try:
+        with open(path, 'r') as f:
+          src = f.read()
+      except OSError:
+        # reported when the import is mapped
+        return
+
+      if (loaded := loaded_modules.get(path)) is not None and loaded[0] == src:
+        discover(path, loaded[1][1])
+      else:
+        try:
+          pending[executor.submit(lex_and_parse_captured, src, path)] = (path, src)
+        except BrokenProcessPool:
+          # the module is loaded by the main process when it is mapped
+          pass
+
+    def discover(path, ast):
+      for import_path in get_import_paths(path, ast):
+        if import_path not in seen:
+          seen.add(import_path)
+          load(import_path)
+
+    for path in paths:
+      load(path)
+
+    while len(pending) > 0:
+      done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+      for future in done:
+        path, src = pending.pop(future)
+
+        try:
+          ast = future.result()
+        except Exception:
+          # a worker that failed only loses the preloading, the module
+          # is loaded by the main process when it is mapped
+          continue
+
+        if ast is None:
+          continue
+
+        preloaded_modules[path] = (src, (None, ast))
+        discover(path, ast)
+
 def gen_and_cache_module_setupper(g):
-  utils.modules_setupper_llvm_fns.append(
-    g.gen_module_setuper_fn()
-  )
+  with phase('gen_setupper', g.path):
+    utils.modules_setupper_llvm_fns.append(
+      g.gen_module_setuper_fn()
+    )
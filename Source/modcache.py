@@ -0,0 +1,137 @@
+from astfile import dump_ast, load_ast
+from contextlib import redirect_stdout
+from hashlib import sha256
+from io import StringIO
+from os import environ, getpid, makedirs, replace
+from os.path import dirname, expanduser, join
+from sys import argv
+from data import SourceFile
+from lex import lex, lex_stream
+from parse import parse
+from phases import phase
+from utils import fixpath
+
+import utils
+
+# the files whose content affects the tokens and the ast produced for a module
+FRONTEND_SOURCES = ['lex.py', 'parse.py', 'data.py', 'utils.py', 'modcache.py', 'astfile.py']
+
+compiler_version = None
+
+# modules already lexed and parsed by this process, a long running `zpp serve`
+# reuses them across builds as long as their source did not change
+loaded_modules = {}
+
+# modules lexed and parsed ahead of time by worker processes, see `mapast.preload_modules`
+preloaded_modules = {}
+
+def is_module_cache_enabled():
+  return '--no-module-cache' not in argv
+
+def is_streaming_toks():
+  return '--stream-tokens' in argv
+
+def get_cache_dir():
+  base = environ.get('XDG_CACHE_HOME', expanduser('~/.cache'))
+  return fixpath(join(base, 'zpp'))
+
+def get_compiler_version():
+  global compiler_version
+
+  if compiler_version is not None:
+    return compiler_version
+
+  # the location is part of the version because package paths
+  # are resolved relatively to the compiler while parsing
+  source_dir = dirname(fixpath(__file__))
+  h = sha256(source_dir.encode())
+
+  for filename in FRONTEND_SOURCES:
+    with open(join(source_dir, filename), 'rb') as f:
+      h.update(f.read())
+
+  compiler_version = h.hexdigest()
+  return compiler_version
+
+def get_entry_path(path):
+  return fixpath(join(get_cache_dir(), 'modules', sha256(path.encode()).hexdigest() + '.ast'))
+
+def get_entry_key(src):
+  return sha256((get_compiler_version() + src).encode()).hexdigest().encode()
+
+def load_entry(entry_path, key, src, path):
+  try:
+    with open(entry_path, 'rb') as f:
+      if f.readline().rstrip(b'\n') != key:
+        return None
+
+      # the tokens are not stored, no caller needs them once the ast is built
+      return None, load_ast(f, SourceFile(src, path))
+  except Exception:
+    # a missing, stale or corrupted entry is just a cache miss
+    return None
+
+def store_entry(entry_path, key, ast):
+  tmp_path = f'{entry_path}.{getpid()}.tmp'
+
+  try:
+    makedirs(dirname(entry_path), exist_ok=True)
+
+    with open(tmp_path, 'wb') as f:
+      f.write(key + b'\n')
+      dump_ast(f, ast, ast[0].pos.file if len(ast) > 0 else None)
+
+    replace(tmp_path, entry_path)
+  except OSError:
+    pass
+
+def lex_and_parse_uncached(src, path):
+  if is_streaming_toks():
+    # the lexer runs while the parser consumes its tokens, so the lex time
+    # is part of the parse phase and the full list of tokens is never built
+    with phase('parse', path):
+      ast = parse(lex_stream(src, path), utils.counters)
+
+    return None, ast
+
+  with phase('lex', path):
+    toks = lex(src, path)
+
+  with phase('parse', path):
+    ast = parse(toks, utils.counters)
+
+  return toks, ast
+
+def lex_and_parse_captured(src, path):
+  # runs in a worker process, a module with errors is left to the main
+  # process, so that its error is reported when the module is reached,
+  # only the ast is sent back, the main process does not need the tokens
+  with redirect_stdout(StringIO()):
+    try:
+      return lex_and_parse(src, path)[1]
+    except SystemExit:
+      return None
+
+def lex_and_parse(src, path):
+  if (preloaded := preloaded_modules.pop(path, None)) is not None and preloaded[0] == src:
+    return preloaded[1]
+
+  if not is_module_cache_enabled():
+    return lex_and_parse_uncached(src, path)
+
+  if (loaded := loaded_modules.get(path)) is not None and loaded[0] == src:
+    return loaded[1]
+
+  entry_path = get_entry_path(path)
+  key = get_entry_key(src)
+
+  with phase('module_cache', path):
+    entry = load_entry(entry_path, key, src, path)
+
+  if entry is None:
+    entry = lex_and_parse_uncached(src, path)
+    store_entry(entry_path, key, entry[1])
+
+  loaded_modules[path] = (src, entry)
+
+  return entry
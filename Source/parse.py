@@ -11,16 +11,33 @@ UNALLOWED_ON_INLINE_DEFER_NODE = [
   'for_node', 'var_decl_node'
 ] + UNALLOWED_ON_BLOCK_DEFER_NODE
 
+# binary operators from the loosest to the tightest
+BIN_OPS_PRECEDENCES = {
+  'or': 1,
+  'and': 2,
+  '==': 3, '!=': 3, '<': 3, '>': 3, '<=': 3, '>=': 3,
+  '+': 4, '-': 4,
+  '*': 5, '/': 5, '%': 5
+}
+TIGHTEST_PRECEDENCE = 5
+
 class Parser:
   def __init__(self, toks):
-    self.toks = toks
+    # when `toks` is a stream instead of a list, the tokens are pulled
+    # into `self.toks` only when needed and dropped after each global
+    self.is_streaming = not isinstance(toks, list)
+    self.stream = iter(toks) if self.is_streaming else None
+    self.toks = [] if self.is_streaming else toks
+    self.last_tok = None if self.is_streaming or len(toks) == 0 else toks[-1]
     self.index = 0
     self.indents = [0]
     self.stmt_parser_fn = self.parse_stmt
+    # the parser never goes back over a lookahead, each scan is done once
+    self.lookahead_scans = 0
   
   @property
   def eof_pos(self):
-    return self.toks[-1].pos if len(self.toks) > 0 else (1, 1)
+    return self.last_tok.pos if self.last_tok is not None else None
 
   @property
   def cur(self):
@@ -28,7 +45,26 @@ class Parser:
 
   @property
   def has_tok(self):
-    return self.index < len(self.toks)
+    return self.index < len(self.toks) or self.pull_tok()
+
+  def pull_tok(self):
+    if self.stream is None:
+      return False
+
+    tok = next(self.stream, None)
+
+    if tok is None:
+      self.stream = None
+      return False
+
+    self.toks.append(tok)
+    self.last_tok = tok
+    return True
+
+  def drop_consumed_toks(self):
+    # no lookahead or lookback crosses a global
+    del self.toks[:self.index]
+    self.index = 0
 
   @property
   def cur_indent(self):
@@ -53,16 +89,20 @@ class Parser:
     if not self.has_tok:
       return False
 
-    return self.cur.kind == kind and (allow_on_new_line or not self.cur.is_on_new_line)
+    tok = self.toks[self.index]
+    return tok.kind == kind and (allow_on_new_line or not tok.is_on_new_line)
 
   def expect_and_consume(self, kind, allow_on_new_line=False):
-    if self.cur.kind != kind:
-      error(f'expected `{kind}`, found `{self.cur.kind}`', self.cur.pos)
+    tok = self.cur
+
+    if tok.kind != kind:
+      error(f'expected `{kind}`, found `{tok.kind}`', tok.pos)
     
-    if not allow_on_new_line and self.cur.is_on_new_line:
-      error(f'unexpected token to be on a new line', self.cur.pos)
+    if not allow_on_new_line and tok.is_on_new_line:
+      error(f'unexpected token to be on a new line', tok.pos)
     
-    return self.consume_cur()
+    self.advance()
+    return tok
 
   def parse_struct_fields(self, is_union_node=False):
     fields = []
@@ -139,11 +179,25 @@ class Parser:
       return self.make_node(
         'struct_type_node',
         fields=fields,
+        is_reordered=False,
         pos=pos
       )
 
     t = self.expect_and_consume('id')
 
+    if t.value == 'reorder' and self.match_tok('!'):
+      # a struct whose fields are laid out in the order that wastes the least padding
+      self.advance()
+      self.expect_and_consume('(')
+      fields = self.parse_struct_fields()
+
+      return self.make_node(
+        'struct_type_node',
+        fields=fields,
+        is_reordered=True,
+        pos=t.pos
+      )
+
     if self.match_tok('['):
       pos = self.cur.pos
       generics = self.parse_generics_in_call(use_fn_notation=False)
@@ -236,14 +290,23 @@ class Parser:
 
     return self.parse_type()
 
-  def parse_bin(self, allow_left_on_new_line, ops, terms_parser_fn):
-    self.throw_error_when_tok_on_new_line_and_not_allowed(allow_left_on_new_line)
-
-    left = terms_parser_fn()
+  def parse_bin(self, allow_left_on_new_line, min_precedence):
+    left = self.parse_term()
     
-    while self.match_toks(ops):
-      op = self.consume_cur()
-      right = terms_parser_fn()
+    while self.has_tok:
+      op = self.toks[self.index]
+      precedence = BIN_OPS_PRECEDENCES.get(op.kind)
+
+      if precedence is None or precedence < min_precedence or op.is_on_new_line:
+        break
+
+      self.advance()
+
+      # the right operand of the tightest operators is a term, which is allowed on a new line
+      if precedence != TIGHTEST_PRECEDENCE:
+        self.throw_error_when_tok_on_new_line_and_not_allowed(allow_left_on_new_line)
+
+      right = self.parse_bin(allow_left_on_new_line, precedence + 1)
 
       left = self.make_node(
         'bin_node',
@@ -304,6 +367,7 @@ class Parser:
   
   def match_pattern(self, pattern_toks, allow_first_on_new_line=False):
     old_index = self.index
+    self.lookahead_scans += 1
 
     for i, tok in enumerate(pattern_toks):
       if tok is None:
@@ -507,17 +571,8 @@ class Parser:
     return self.consume_cur()
 
   def parse_expr(self, allow_left_on_new_line=False):
-    expr = self.parse_bin(
-      allow_left_on_new_line, ['or'], lambda: self.parse_bin(
-        allow_left_on_new_line,['and'], lambda: self.parse_bin(
-          allow_left_on_new_line, ['==', '!=', '<', '>', '<=', '>='], lambda: self.parse_bin(
-            allow_left_on_new_line, ['+', '-'], lambda: self.parse_bin(
-              allow_left_on_new_line, ['*', '/', '%'], lambda: self.parse_term()
-            )
-          )
-        )
-      )
-    )
+    self.throw_error_when_tok_on_new_line_and_not_allowed(allow_left_on_new_line)
+    expr = self.parse_bin(allow_left_on_new_line, 1)
 
     while self.match_toks(['if']):
       match self.cur.kind:
@@ -531,11 +586,11 @@ class Parser:
 
 
   def match_toks(self, toks, allow_on_new_line=False):
-    for tok in toks:
-      if self.match_tok(tok, allow_on_new_line=allow_on_new_line):
-        return True
-    
-    return False
+    if not self.has_tok:
+      return False
+
+    tok = self.toks[self.index]
+    return tok.kind in toks and (allow_on_new_line or not tok.is_on_new_line)
 
   def parse_if_node(self):
     if_branch = None
@@ -975,6 +1030,9 @@ class Parser:
     )
 
   def parse_next_global(self):
+    if self.is_streaming:
+      self.drop_consumed_toks()
+
     if not self.has_tok:
       return
     
@@ -1005,7 +1063,7 @@ class Parser:
     
     return node
 
-def parse(toks):
+def parse(toks, counters=None):
   p = Parser(toks)
   r = []
 
@@ -1016,5 +1074,8 @@ def parse(toks):
       break
     
     r.append(node)
+
+  if counters is not None:
+    counters['lookahead_scans'] += p.lookahead_scans
   
   return r
\ No newline at end of file
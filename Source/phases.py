@@ -0,0 +1,119 @@
+import tracemalloc
+
+from contextlib import nullcontext
+from json import dump
+from os.path import relpath
+from time import perf_counter
+from utils import get_argv_option
+
+import utils
+
+NULL_PHASE = nullcontext()
+
+class Phase:
+  def __init__(self, name, module):
+    self.key = (name, module)
+
+  def __enter__(self):
+    if tracemalloc.is_tracing():
+      current, peak = tracemalloc.get_traced_memory()
+      # the peak is reset for every phase, so the parent phase has to remember
+      # the one reached so far before it gets lost
+      if len(utils.phases_stack) > 0:
+        utils.phases_stack[-1].peak_memory = max(utils.phases_stack[-1].peak_memory, peak)
+
+      tracemalloc.reset_peak()
+      self.start_memory = self.peak_memory = current
+    else:
+      self.start_memory = self.peak_memory = 0
+
+    self.children_time = 0
+    utils.phases_stack.append(self)
+    self.start = perf_counter()
+
+    return self
+
+  def __exit__(self, *_):
+    wall = perf_counter() - self.start
+    utils.phases_stack.pop()
+
+    if tracemalloc.is_tracing():
+      self.peak_memory = max(self.peak_memory, tracemalloc.get_traced_memory()[1])
+
+    if len(utils.phases_stack) > 0:
+      parent = utils.phases_stack[-1]
+      parent.children_time += wall
+      parent.peak_memory = max(parent.peak_memory, self.peak_memory)
+
+    record = utils.phase_records.setdefault(
+      self.key, { 'calls': 0, 'wall': 0, 'self': 0, 'peak_memory': 0 }
+    )
+
+    record['calls'] += 1
+    record['self'] += wall - self.children_time
+    record['peak_memory'] = max(record['peak_memory'], self.peak_memory - self.start_memory)
+
+    # recursive phases (such as functions generated while generating another one)
+    # only count the outermost wall time
+    if all(p.key != self.key for p in utils.phases_stack):
+      record['wall'] += wall
+
+def phase(name, module=None):
+  return Phase(name, module) if utils.time_phases else NULL_PHASE
+
+def start_timing_phases():
+  if utils.is_timing_phases() and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+def get_phases_report(path, total):
+  return {
+    'file': path,
+    'total_ms': total * 1000,
+    'phases': [
+      {
+        'phase': name,
+        'module': module,
+        'calls': record['calls'],
+        'wall_ms': record['wall'] * 1000,
+        'self_ms': record['self'] * 1000,
+        'peak_memory_bytes': record['peak_memory']
+      } for (name, module), record in utils.phase_records.items()
+    ],
+    'counters': utils.counters
+  }
+
+def print_phases_report(report):
+  totals = {}
+
+  for p in report['phases']:
+    t = totals.setdefault(p['phase'], { 'calls': 0, 'self_ms': 0, 'peak_memory_bytes': 0 })
+    t['calls'] += p['calls']
+    t['self_ms'] += p['self_ms']
+    t['peak_memory_bytes'] = max(t['peak_memory_bytes'], p['peak_memory_bytes'])
+
+  print(f"[+] phases of '{relpath(report['file'])}', total: {report['total_ms']:.1f} ms")
+
+  for name, t in totals.items():
+    print(f"  {name:<16} {t['self_ms']:>10.1f} ms {t['calls']:>7} calls {t['peak_memory_bytes'] / 1024:>10.1f} KiB peak")
+
+  print('[+] by module')
+
+  for p in sorted(report['phases'], key=lambda p: -p['self_ms']):
+    module = '-' if p['module'] is None else relpath(p['module'])
+    print(f"  {p['phase']:<16} {p['self_ms']:>10.1f} ms {p['calls']:>7} calls {p['peak_memory_bytes'] / 1024:>10.1f} KiB peak  {module}")
+
+  print('[+] counters')
+
+  for name, count in report['counters'].items():
+    print(f'  {name:<32} {count}')
+
+def report_phases(path, total):
+  report = get_phases_report(path, total)
+  print_phases_report(report)
+
+  if (report_path := get_argv_option('--time-phases')) is not None:
+    with open(report_path, 'w') as f:
+      dump(report, f, indent=2)
+
+  if tracemalloc.is_tracing():
+    tracemalloc.stop()
@@ -0,0 +1,45 @@
+from cProfile import Profile
+from os.path import basename
+from pstats import Stats
+from sys import argv
+from utils import get_argv_option
+
+DEFAULT_PROFILE_PATH = 'zpp.prof'
+SUMMARY_SIZE = 15
+
+# the groups of the summary, as (title, file, method prefix)
+SUMMARY_GROUPS = [
+  ('Generator.evaluate_*', 'gen.py', 'evaluate_'),
+  ('Parser.parse_*', 'parse.py', 'parse_'),
+]
+
+def get_profile_path():
+  if (path := get_argv_option('--profile-compiler')) is not None:
+    return path
+
+  return DEFAULT_PROFILE_PATH if '--profile-compiler' in argv else None
+
+def print_profile_summary(stats):
+  for title, filename, prefix in SUMMARY_GROUPS:
+    rows = [
+      (fn_name, nc, tt, ct)
+        for (path, _, fn_name), (_, nc, tt, ct, _) in stats.stats.items()
+          if basename(path) == filename and fn_name.startswith(prefix)
+    ]
+    rows.sort(key=lambda row: -row[3])
+
+    print(f'[+] {title} by cumulative time')
+
+    for fn_name, nc, tt, ct in rows[:SUMMARY_SIZE]:
+      print(f'  {fn_name:<40} {nc:>8} calls {tt * 1000:>10.1f} ms self {ct * 1000:>10.1f} ms cumulative')
+
+def profile_call(fn, profile_path):
+  profiler = Profile()
+
+  try:
+    return profiler.runcall(fn)
+  finally:
+    # the profile is written even when the compilation stops with an error
+    profiler.dump_stats(profile_path)
+    print(f"[+] profile written to '{profile_path}'")
+    print_profile_summary(Stats(profiler))
@@ -0,0 +1,121 @@
+from json import loads
+from os import chdir, close, dup, dup2, getcwd, listdir, makedirs, remove, stat
+from os.path import dirname, exists, join
+from socket import AF_UNIX, SOCK_STREAM, recv_fds, socket
+from sys import argv, stderr, stdout
+from traceback import print_exc
+from client import get_socket_path
+from utils import error
+
+def get_sources_stamp():
+  source_dir = dirname(__file__)
+
+  return [
+    (filename, stat(join(source_dir, filename)).st_mtime_ns)
+      for filename in sorted(listdir(source_dir)) if filename.endswith('.py')
+  ]
+
+def run_request(run):
+  try:
+    r = run()
+    return 0 if r is None else r
+  except SystemExit as e:
+    if isinstance(e.code, str):
+      print(e.code, file=stderr)
+      return 1
+
+    return 0 if e.code is None else e.code
+  except Exception:
+    print_exc()
+    return 1
+
+def receive_request(conn):
+  msg, fds, _, _ = recv_fds(conn, 1 << 16, 3)
+
+  while chunk := conn.recv(1 << 16):
+    msg += chunk
+
+  # connections that are not sent by the client, such as the probe
+  # of another `zpp serve`, are just dropped
+  if len(fds) != 3 or msg == b'':
+    for fd in fds:
+      close(fd)
+
+    return None, None
+
+  return loads(msg), fds
+
+def handle_request(conn, request, fds, run):
+  saved_fds = [dup(fd) for fd in range(3)]
+  saved_cwd = getcwd()
+
+  # the build runs as if it was started by the client, with its
+  # standard streams, working directory and command line
+  stdout.flush()
+  stderr.flush()
+
+  try:
+    for fd, received_fd in enumerate(fds):
+      dup2(received_fd, fd)
+
+    chdir(request['cwd'])
+    argv[:] = request['argv']
+
+    exitcode = run_request(run)
+  finally:
+    stdout.flush()
+    stderr.flush()
+
+    for fd, saved_fd in enumerate(saved_fds):
+      dup2(saved_fd, fd)
+      close(saved_fd)
+
+    for fd in fds:
+      close(fd)
+
+    chdir(saved_cwd)
+
+  conn.sendall(str(exitcode).encode())
+
+def serve(run):
+  socket_path = get_socket_path()
+  sources_stamp = get_sources_stamp()
+
+  if exists(socket_path):
+    with socket(AF_UNIX, SOCK_STREAM) as s:
+      if s.connect_ex(socket_path) == 0:
+        error(f'a compile server is already listening on `{socket_path}`', None)
+
+    remove(socket_path)
+
+  makedirs(dirname(socket_path), exist_ok=True)
+
+  with socket(AF_UNIX, SOCK_STREAM) as server:
+    server.bind(socket_path)
+    server.listen()
+    print(f'[+] serving on `{socket_path}`', flush=True)
+
+    try:
+      while True:
+        conn, _ = server.accept()
+
+        with conn:
+          request, fds = receive_request(conn)
+
+          if request is None:
+            continue
+
+          if get_sources_stamp() != sources_stamp:
+            for fd in fds:
+              close(fd)
+
+            conn.sendall(b'stale')
+            break
+
+          handle_request(conn, request, fds, run)
+    except KeyboardInterrupt:
+      pass
+    finally:
+      remove(socket_path)
+
+  return 0
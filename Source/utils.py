@@ -3,16 +3,29 @@ from os.path import abspath
 from posixpath import isabs, relpath
 from sys import argv
 
-from llvmlite.ir import Module
+from llvmlite.ir import Context, Module
 
-def setup_globals():
+# counts the builds of the process, see `RealType.get_type_id`
+build_generation = 0
+
+def setup_globals(main_path=None):
   global cache, output, libs_to_import, additional_clang_flags
-  global llvm_internal_functions_cache, strings_cache
+  global llvm_internal_functions_cache, strings_cache, llvm_context, llvm_types_cache
   global llvm_internal_vars_cache, intrinsic_modules
   global enums_cache, enums_count, modules_setupper_llvm_fns
+  global time_phases, phases_stack, phase_records, counters
+  global reporting_layouts, lowered_layouts
+  global build_generation, realtype_ids
 
   cache = {}
-  output = Module()
+  build_generation += 1
+  # the type table, equal types are compared by the id it gives them
+  realtype_ids = {}
+  # the named llvm structs are declared in the context of the llvm module,
+  # incremental builds give every module its own, see `Generator`
+  llvm_context = Context()
+  llvm_types_cache = {}
+  output = Module(context=llvm_context)
   libs_to_import = set()
   llvm_internal_functions_cache = {}
   strings_cache = {}
@@ -21,30 +34,52 @@ def setup_globals():
   enums_count = 0
   modules_setupper_llvm_fns = []
   additional_clang_flags = ''
+  time_phases = is_timing_phases()
+  phases_stack = []
+  phase_records = {}
+  counters = new_counters()
+  reporting_layouts = is_reporting_layouts()
+  # the structs and unions lowered by the build, with their llvm types, by the llvm type
+  lowered_layouts = {}
+
+  from modcache import lex_and_parse
+  from mapast import cache_mapast, gen_and_cache_module_setupper, preload_modules
 
-  from lex import lex
-  from parse import parse
-  from mapast import cache_mapast, gen_and_cache_module_setupper
+  preload_modules(intrinsic_modules + ([main_path] if main_path is not None else []))
 
   for m in intrinsic_modules:
     with open(m) as f:
       src = f.read()
 
-    toks = lex(src, m)
-    ast = parse(toks)
+    _, ast = lex_and_parse(src, m)
     g = cache_mapast(m, ast)
     
     gen_and_cache_module_setupper(g)
 
+def new_counters():
+  return {
+    'functions_generated': 0, 'generic_instantiations': 0, 'strings_cached': 0, 'lookahead_scans': 0,
+    'instantiation_cache_lookups': 0, 'instantiation_cache_comparisons': 0
+  }
+
+def setup_worker_globals():
+  # the globals used by the lexer and the parser, for the worker processes, which don't
+  # inherit them when they are spawned instead of forked, their phases are not reported
+  global time_phases, phases_stack, phase_records, counters
+
+  time_phases = False
+  phases_stack = []
+  phase_records = {}
+  counters = new_counters()
+
 def error(msg, pos):
   if pos is None:
     exit(f'error: {msg}')
 
-  line, col, src, _ = pos
-  lines = src.split('\n')
+  line, col = pos.file.get_line_and_col(pos.offset)
 
   print(f'{repr_pos(pos, use_path=True)}: {msg}')
-  print(f'+ {lines[line - 1]}')
+  print(f'+ {pos.file.get_line_src(line)}')
   exit(f'+ {" " * (col - 1)}^')
 
 def getabspath(relative_path):
@@ -88,6 +123,9 @@ def has_infinite_recursive_layout(realtype, in_progres_struct_rt_ids=[]):
   
   return False
 
+def align_to(offset, align):
+  return (offset + align - 1) // align * align
+
 def var_is_comptime(name):
   return name[0].isupper()
 
@@ -95,16 +133,15 @@ def string_contains_float(s):
   return '.' in s
 
 def has_to_import_all_ids(ids):
-  from data import Node
-
-  return isinstance(ids, Node)
+  # `import *` keeps the `*` token instead of a list of ids
+  return not isinstance(ids, list)
 
 def repr_pos(pos, use_path=False):
-  line, col, _, path = pos
+  line, col = pos.file.get_line_and_col(pos.offset)
   r = f'[line: {line}, col: {col}]'
 
   if use_path:
-    r = f"'{relpath(path)}' {r}"
+    r = f"'{relpath(pos.path)}' {r}"
 
   return r
 
@@ -169,6 +206,46 @@ def is_debug_build():
 def is_release_build():
   return '--release' in argv
 
+def is_incremental_build():
+  return '--incremental' in argv
+
+def get_argv_option(name, default=None):
+  prefix = f'{name}='
+
+  for arg in argv:
+    if arg.startswith(prefix):
+      return arg[len(prefix):]
+
+  return default
+
+def is_timing_phases():
+  return '--time-phases' in argv or get_argv_option('--time-phases') is not None
+
+def is_reporting_layouts():
+  return '--layout-report' in argv
+
+def get_jobs():
+  if '-j' not in argv:
+    return 1
+
+  try:
+    jobs = int(argv[argv.index('-j') + 1])
+  except (IndexError, ValueError):
+    error('`-j` expects the number of jobs', None)
+
+  if jobs < 1:
+    error('`-j` expects at least one job', None)
+
+  return jobs
+
+def get_backend():
+  backend = get_argv_option('--backend', 'clang')
+
+  if backend not in ['clang', 'inprocess']:
+    error(f'unknown backend `{backend}`, expected `clang` or `inprocess`', None)
+
+  return backend
+
 def equal_dicts(d1, d2, ignore_keys):
   d1_filtered = { k: v for k, v in d1.items() if k not in ignore_keys }
   d2_filtered = { k: v for k, v in d2.items() if k not in ignore_keys }
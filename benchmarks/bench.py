@@ -0,0 +1,229 @@
+# usage:
+#   python benchmarks/bench.py [--out results.json] [--repeat N] [--sizes 1000,10000,100000]
+#     without `--out` the results are written to the temporary directory
+#   python benchmarks/bench.py compare base.json new.json [--threshold percent]
+
+from glob import glob
+from json import dump, load
+from os.path import abspath, dirname, join, relpath
+from platform import platform, python_version
+from sys import argv, path as sys_path
+from tempfile import gettempdir
+from time import perf_counter, strftime
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys_path.insert(0, join(ROOT, 'Source'))
+
+from data import Node, Token
+from lex import lex
+from mapast import cache_mapast, gen_and_cache_module_setupper
+from parse import parse
+from synthetic import generate_module
+
+import utils
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 10
+# small inputs are measured again until they took at least this time
+MIN_TOTAL_TIME = 0.2
+UNITS = { 'lex': 'tokens/s', 'parse': 'nodes/s', 'gen': 'functions/s' }
+
+def get_option(name, default):
+  return argv[argv.index(name) + 1] if name in argv else default
+
+def count_nodes(ast):
+  count = 0
+  to_visit = list(ast)
+
+  while len(to_visit) > 0:
+    obj = to_visit.pop()
+
+    if isinstance(obj, Node):
+      count += 1
+      to_visit.extend(obj.get_fields().values())
+    elif isinstance(obj, Token):
+      count += 1
+    elif isinstance(obj, (list, tuple)):
+      to_visit.extend(obj)
+
+  return count
+
+def best_of(repeat, fn):
+  best = None
+  runs = 0
+  total = 0
+
+  while runs < repeat or total < MIN_TOTAL_TIME:
+    start = perf_counter()
+    r = fn()
+    elapsed = perf_counter() - start
+
+    runs += 1
+    total += elapsed
+
+    if best is None or elapsed < best:
+      best = elapsed
+
+  return best, r
+
+def prepare_module(path, src):
+  utils.setup_globals()
+
+  is_new = path not in utils.cache
+  # not through the module cache, which would keep an entry for every benchmarked path
+  ast = parse(lex(src, path))
+  g = cache_mapast(path, ast)
+  utils.check_imports_of_all_modules()
+
+  if is_new:
+    gen_and_cache_module_setupper(g)
+
+  return g
+
+def gen_module_fns(g):
+  for sym in list(g.maps[0].symbols.values()):
+    if sym.kind == 'fn_sym' and len(sym.node.generics) == 0:
+      g.gen_nongeneric_fn(sym)
+
+def bench_gen(path, src, repeat):
+  # only the generation of the functions is measured, the module
+  # and its imports are mapped again before every run
+  best = None
+
+  for _ in range(repeat):
+    g = prepare_module(path, src)
+    functions_generated = utils.counters['functions_generated']
+
+    start = perf_counter()
+    gen_module_fns(g)
+    elapsed = perf_counter() - start
+
+    if best is None or elapsed < best:
+      best = elapsed
+
+  return best, utils.counters['functions_generated'] - functions_generated
+
+def record(results, kind, name, items, seconds):
+  rate = items / seconds if seconds > 0 else 0
+  results[f'{kind}:{name}'] = { 'items': items, 'seconds': seconds, 'rate': rate, 'unit': UNITS[kind] }
+  print(f'  {kind:<6} {name:<40} {items:>9} items {seconds * 1000:>10.1f} ms {rate:>12.0f} {UNITS[kind]}', flush=True)
+
+def record_total(results, kind, name, names):
+  keys = [f'{kind}:{n}' for n in names if f'{kind}:{n}' in results]
+
+  if len(keys) > 0:
+    record(
+      results, kind, name,
+      sum(results[k]['items'] for k in keys),
+      sum(results[k]['seconds'] for k in keys)
+    )
+
+def bench_frontend(results, name, path, src, repeat):
+  lex_time, toks = best_of(repeat, lambda: lex(src, path))
+  record(results, 'lex', name, len(toks), lex_time)
+
+  try:
+    parse_time, ast = best_of(repeat, lambda: parse(toks))
+  except SystemExit:
+    # some samples are not updated to the current syntax
+    print(f'  parse  {name:<40} skipped, it does not parse')
+    return
+
+  record(results, 'parse', name, count_nodes(ast), parse_time)
+
+def bench_file(results, path, repeat, with_gen):
+  name = relpath(path, ROOT)
+
+  with open(path, 'r') as f:
+    src = f.read()
+
+  bench_frontend(results, name, path, src, repeat)
+
+  if not with_gen:
+    return
+
+  gen_time, functions_count = bench_gen(path, src, repeat)
+
+  # modules with only generic functions have nothing to generate on their own
+  if functions_count > 0:
+    record(results, 'gen', name, functions_count, gen_time)
+
+def bench_synthetic(results, lines_count, repeat):
+  name = f'synthetic/{lines_count}'
+  path = join(ROOT, 'benchmarks', f'Synthetic{lines_count}.zpp')
+  src = generate_module(lines_count)
+
+  bench_frontend(results, name, path, src, repeat)
+
+  gen_time, functions_count = bench_gen(path, src, repeat)
+  record(results, 'gen', name, functions_count, gen_time)
+
+def run():
+  repeat = int(get_option('--repeat', DEFAULT_REPEAT))
+  sizes = list(map(int, get_option('--sizes', ','.join(map(str, DEFAULT_SIZES))).split(',')))
+  output_path = get_option('--out', join(gettempdir(), f'zpp-bench-{strftime("%Y%m%d-%H%M%S")}.json'))
+  results = {}
+
+  print('[+] Packages/System')
+  packages = sorted(glob(join(ROOT, 'Packages', 'System', '*.zpp')))
+
+  for path in packages:
+    bench_file(results, path, repeat, with_gen=True)
+
+  for kind in ['lex', 'parse', 'gen']:
+    record_total(results, kind, 'Packages/System', [relpath(p, ROOT) for p in packages])
+
+  print('[+] Samples and TestingSpace')
+
+  for path in sorted(glob(join(ROOT, 'Samples', '*.zpp')) + glob(join(ROOT, 'TestingSpace', '*.zpp'))):
+    bench_file(results, path, repeat, with_gen=False)
+
+  print('[+] synthetic')
+
+  for lines_count in sizes:
+    bench_synthetic(results, lines_count, repeat)
+
+  with open(output_path, 'w') as f:
+    dump({
+      'date': strftime('%Y-%m-%d %H:%M:%S'),
+      'python': python_version(),
+      'platform': platform(),
+      'repeat': repeat,
+      'results': results
+    }, f, indent=2)
+
+  print(f"[+] results written to '{output_path}'")
+  return 0
+
+def compare():
+  with open(argv[2], 'r') as f:
+    base = load(f)['results']
+
+  with open(argv[3], 'r') as f:
+    new = load(f)['results']
+
+  threshold = float(get_option('--threshold', DEFAULT_THRESHOLD))
+  regressions = 0
+
+  for key in base:
+    if key not in new:
+      continue
+
+    change = (new[key]['rate'] / base[key]['rate'] - 1) * 100 if base[key]['rate'] > 0 else 0
+    is_regression = change < -threshold
+    regressions += is_regression
+
+    print(
+      f"  {key:<48} {base[key]['rate']:>12.0f} -> {new[key]['rate']:>12.0f} {new[key]['unit']:<12}"
+      f" {change:>+7.1f}%{'  REGRESSION' if is_regression else ''}"
+    )
+
+  print(f'[+] {regressions} regressions over {threshold}%')
+  return 1 if regressions > 0 else 0
+
+if __name__ == '__main__':
+  if len(argv) > 1 and argv[1] == 'compare':
+    exit(compare())
+
+  exit(run())
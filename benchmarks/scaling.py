@@ -0,0 +1,131 @@
+# usage:
+#   python benchmarks/scaling.py [--max-slope 1.3] [--steps N]
+#
+# compiles synthetic projects of growing size along a few dimensions and fails when
+# the compile time or the peak memory grows super linearly with the size of the project
+
+from json import dumps, loads
+from math import log
+from os.path import abspath, dirname, join
+from shutil import rmtree
+from subprocess import run
+from sys import argv, executable, path as sys_path
+from tempfile import mkdtemp
+from time import perf_counter
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys_path.insert(0, join(ROOT, 'Source'))
+
+from synthetic import generate_project
+
+DEFAULT_MAX_SLOPE = 1.3
+DEFAULT_STEPS = 4
+TIME_RUNS = 3
+
+BASE_PROJECT = { 'modules_count': 4, 'depth': 2, 'functions_count': 8, 'generic_types_count': 2, 'instantiations_count': 4 }
+# every series doubles one dimension of the base project at each step
+SERIES = ['modules_count', 'functions_count', 'instantiations_count']
+
+def get_option(name, default):
+  return argv[argv.index(name) + 1] if name in argv else default
+
+def measure(main_path):
+  import tracemalloc
+  import utils
+
+  from main import compile
+
+  # the frontend is measured too, not the module cache
+  argv.append('--no-module-cache')
+
+  if '--memory' in argv:
+    tracemalloc.start()
+
+  start = perf_counter()
+  compile(main_path)
+  str(utils.output)
+  seconds = perf_counter() - start
+
+  peak_memory = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+  print(dumps({ 'seconds': seconds, 'peak_memory': peak_memory }))
+
+def measure_in_subprocess(main_path, trace_memory):
+  # every measurement runs in a new process, so that nothing is cached
+  # across them and memory is measured on its own (tracing slows down the compiler)
+  cmd = [executable, abspath(__file__), 'measure', main_path] + (['--memory'] if trace_memory else [])
+  p = run(cmd, capture_output=True, text=True, cwd=dirname(main_path))
+
+  if p.returncode != 0:
+    exit(f'error: compiling `{main_path}` failed\n{p.stdout}{p.stderr}')
+
+  return loads(p.stdout.strip().split('\n')[-1])
+
+def measure_project(folder, config):
+  main_path = generate_project(folder, **config)
+
+  with open(main_path, 'r') as f:
+    lines_count = len(f.read().split('\n'))
+
+  for m in range(config['modules_count']):
+    with open(join(folder, f'Mod{m}.zpp'), 'r') as f:
+      lines_count += len(f.read().split('\n'))
+
+  seconds = min(measure_in_subprocess(main_path, False)['seconds'] for _ in range(TIME_RUNS))
+  peak_memory = measure_in_subprocess(main_path, True)['peak_memory']
+
+  return lines_count, seconds, peak_memory
+
+def get_slope(points):
+  # least squares slope of the log-log curve, 1 means linear growth
+  xs = [log(x) for x, _ in points]
+  ys = [log(max(y, 1e-9)) for _, y in points]
+  mean_x = sum(xs) / len(xs)
+  mean_y = sum(ys) / len(ys)
+
+  return \
+    sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / \
+    sum((x - mean_x) ** 2 for x in xs)
+
+def main():
+  max_slope = float(get_option('--max-slope', DEFAULT_MAX_SLOPE))
+  steps = int(get_option('--steps', DEFAULT_STEPS))
+  folder = mkdtemp(prefix='zpp-scaling-')
+  failures = 0
+
+  try:
+    # the fixed cost of compiling a program (intrinsic modules, stdlib, setup)
+    # is removed from every measurement, so that only the growth is compared
+    _, base_seconds, base_memory = measure_project(join(folder, 'empty'), { **BASE_PROJECT, 'modules_count': 0 })
+
+    for dimension in SERIES:
+      print(f'[+] scaling {dimension}')
+      times = []
+      memories = []
+
+      for step in range(steps):
+        config = { **BASE_PROJECT, dimension: BASE_PROJECT[dimension] * 2 ** step }
+        lines_count, seconds, peak_memory = measure_project(join(folder, f'{dimension}{step}'), config)
+
+        # the growth is compared with the dimension instead of the lines count, since the
+        # rest of the project is a fixed part of both the time and the lines count
+        times.append((config[dimension], seconds - base_seconds))
+        memories.append((config[dimension], peak_memory - base_memory))
+        print(f'  {dimension} = {config[dimension]:<6} {lines_count:>8} lines {seconds * 1000:>10.1f} ms {peak_memory / 1024:>12.1f} KiB peak')
+
+      for name, points in [('time', times), ('memory', memories)]:
+        slope = get_slope(points)
+        is_super_linear = slope > max_slope
+        failures += is_super_linear
+
+        print(f"  {name} slope: {slope:.2f}{'  SUPER LINEAR' if is_super_linear else ''}")
+  finally:
+    rmtree(folder, ignore_errors=True)
+
+  print(f'[+] {failures} super linear growths over a slope of {max_slope}')
+  return 1 if failures > 0 else 0
+
+if __name__ == '__main__':
+  if len(argv) > 1 and argv[1] == 'measure':
+    exit(measure(argv[2]))
+
+  exit(main())
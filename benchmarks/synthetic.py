@@ -0,0 +1,202 @@
+from os import makedirs
+from os.path import join
+from sys import argv
+
+# every chain of functions calls the previous one, the chains are kept short
+# so that generating them does not nest too deep in the generator
+CHAIN_LENGTH = 8
+
+def generate_type(i):
+  return [
+    f'type Pair{i} = (left: i64, right: i64)',
+    '',
+  ]
+
+def generate_fn(i):
+  call = f'step{i - 1}(b, a)' if i % CHAIN_LENGTH != 0 else 'a'
+
+  return [
+    f'fn step{i}(a: i64, b: i64) -> i64:',
+    f'  p: Pair{i} = (left: a, right: b * {i % 7 + 1})',
+    f'  c: i64 = p.left + p.right',
+    f'  if c > {i}:',
+    f'    c = c - a',
+    f'  for .., b > 0, b -= 1:',
+    f'    c += {call}',
+    f'  return same(c)',
+    '',
+  ]
+
+def generate_main(fns_count):
+  lines = ['fn main(argc: u32, argv: **u8) -> Result:', '  x: i64 = 0']
+
+  for i in range(CHAIN_LENGTH - 1, fns_count, CHAIN_LENGTH):
+    lines.append(f'  x += step{i}(cast(i64)argc, 2)')
+
+  lines.append('  return .Ok if x != 0 else .Err')
+  return lines
+
+def generate_module(lines_count):
+  # each function with its type takes 11 lines, plus one main call for each chain
+  fns_count = max(CHAIN_LENGTH, lines_count * CHAIN_LENGTH // (11 * CHAIN_LENGTH + 1))
+  fns_count -= fns_count % CHAIN_LENGTH
+  lines = [
+    'fn same(|T| x: T) -> T:',
+    '  return x',
+    '',
+  ]
+
+  for i in range(fns_count):
+    lines += generate_type(i)
+    lines += generate_fn(i)
+
+  lines += generate_main(fns_count)
+  return '\n'.join(lines) + '\n'
+
+BASE_TYPES = ['i8', 'i16', 'i32', 'i64', 'u8', 'u16', 'u32', 'u64', 'f32', 'f64']
+
+def get_module_layer(i, modules_count, depth):
+  return i * depth // modules_count
+
+def get_module_dependencies(i, modules_count, depth):
+  layer = get_module_layer(i, modules_count, depth)
+
+  if layer == 0:
+    return []
+
+  # every module imports the one at the same position in the previous layer,
+  # which always has a lower index
+  previous_layer = [j for j in range(modules_count) if get_module_layer(j, modules_count, depth) == layer - 1]
+  first_of_layer = min(j for j in range(modules_count) if get_module_layer(j, modules_count, depth) == layer)
+
+  return [previous_layer[(i - first_of_layer) % len(previous_layer)]]
+
+def get_instantiation_type(m, k, generic_types_count):
+  # distinct instantiations are made by wrapping the base types into the generic
+  # types of the module, all the types with one wrapper come before the ones with two,
+  # so that the nesting only grows logarithmically with the instantiations count
+  wrappers_count = 0
+  types_with_wrappers_count = len(BASE_TYPES)
+
+  while k >= types_with_wrappers_count:
+    k -= types_with_wrappers_count
+    wrappers_count += 1
+    types_with_wrappers_count *= generic_types_count
+
+  t = BASE_TYPES[k % len(BASE_TYPES)]
+  literal = f'cast({t}) 1'
+  k //= len(BASE_TYPES)
+
+  for _ in range(wrappers_count):
+    t = f'Box{m}_{k % generic_types_count}[{t}]'
+    literal = f'(value: {literal}, count: 1)'
+    k //= generic_types_count
+
+  return t, literal
+
+def generate_project_module(m, dependencies, functions_count, generic_types_count, instantiations_count):
+  lines = [
+    f"from 'System.List' import [ List, create, append, drop ]",
+  ]
+
+  for d in dependencies:
+    lines.append(f"from 'Mod{d}.zpp' import [ mod{d}_entry ]")
+
+  lines.append('')
+
+  for t in range(generic_types_count):
+    lines += [
+      f'type Box{m}_{t}[T] = (value: T, count: u64)',
+      '',
+    ]
+
+  for i in range(functions_count):
+    if i % CHAIN_LENGTH != 0:
+      call = f'mod{m}_f{i - 1}(b, a)'
+    elif len(dependencies) > 0:
+      call = f'mod{dependencies[0]}_entry(b)'
+    else:
+      call = 'a'
+
+    lines += [
+      f'fn mod{m}_f{i}(a: i64, b: i64) -> i64:',
+      f'  c: i64 = a + b * {i % 7 + 1}',
+      f'  if c > {i}:',
+      f'    c = c - a',
+      f'  for .., b > 0, b -= 1:',
+      f'    c += b',
+      f'  return c + {call}',
+      '',
+    ]
+
+  for k in range(instantiations_count):
+    t, literal = get_instantiation_type(m, k, generic_types_count)
+
+    lines += [
+      f'fn mod{m}_inst{k}(n: i64) -> i64:',
+      f'  l: List[{t}] = create(2)',
+      f'  defer l.mut.drop()',
+      f'  l.mut.append({literal})',
+      f'  return n + cast(i64) l.len',
+      '',
+    ]
+
+  lines += [f'fn mod{m}_entry(n: i64) -> i64:', '  x: i64 = n']
+
+  for i in range(CHAIN_LENGTH - 1, functions_count + CHAIN_LENGTH - 1, CHAIN_LENGTH):
+    lines.append(f'  x += mod{m}_f{min(i, functions_count - 1)}(n, 1)')
+
+  for k in range(instantiations_count):
+    lines.append(f'  x += mod{m}_inst{k}(n)')
+
+  lines.append('  return x')
+  return '\n'.join(lines) + '\n'
+
+def generate_project_main(modules_count):
+  # the modules are called in the order of their layers, so that the generator
+  # finds the imported functions already generated instead of nesting into them
+  lines = []
+
+  for m in range(modules_count):
+    lines.append(f"from 'Mod{m}.zpp' import [ mod{m}_entry ]")
+
+  lines += ['', 'fn main(argc: u32, argv: **u8) -> Result:', '  x: i64 = 0']
+
+  for m in range(modules_count):
+    lines.append(f'  x += mod{m}_entry(cast(i64)argc)')
+
+  lines.append('  return .Ok if x != 0 else .Err')
+  return '\n'.join(lines) + '\n'
+
+def generate_project(path, modules_count, depth, functions_count, generic_types_count, instantiations_count):
+  # writes a project made of `modules_count` modules, arranged in `depth` layers,
+  # where every module imports one of the previous layer, and returns the path of its main module
+  makedirs(path, exist_ok=True)
+  depth = max(1, min(depth, modules_count))
+  generic_types_count = max(1, generic_types_count)
+
+  for m in range(modules_count):
+    src = generate_project_module(
+      m,
+      get_module_dependencies(m, modules_count, depth),
+      functions_count,
+      generic_types_count,
+      instantiations_count
+    )
+
+    with open(join(path, f'Mod{m}.zpp'), 'w') as f:
+      f.write(src)
+
+  main_path = join(path, 'Main.zpp')
+
+  with open(main_path, 'w') as f:
+    f.write(generate_project_main(modules_count))
+
+  return main_path
+
+if __name__ == '__main__':
+  if len(argv) > 1 and argv[1] == 'project':
+    # python benchmarks/synthetic.py project <dir> <modules> <depth> <functions> <generic types> <instantiations>
+    print(generate_project(argv[2], *map(int, argv[3:8])))
+  else:
+    print(generate_module(int(argv[1])), end='')
@@ -0,0 +1,144 @@
+# usage:
+#   python tests/check_incremental.py [--edits N] [--seed S]
+#
+# applies random edits to the modules of the repository through `IncrementalModule`
+# and checks that its tokens and ast, or its error, are the same of lexing and parsing
+# the edited source from scratch, then measures a single keystroke on a big module
+
+from contextlib import redirect_stdout
+from glob import glob
+from io import StringIO
+from os.path import abspath, dirname, join, relpath
+from random import Random
+from sys import argv, path as sys_path
+from time import perf_counter
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys_path.insert(0, join(ROOT, 'Source'))
+sys_path.insert(0, join(ROOT, 'benchmarks'))
+
+from data import Node, Pos, Token
+from incremental import IncrementalModule
+from lex import lex_regex
+from parse import parse
+from synthetic import generate_module
+
+DEFAULT_EDITS = 2000
+EDIT_TEXTS = [
+  'a', '_', '0', ' ', '  ', '\n', '\n\n', '\\', '-- ', "'", '`', '(', ')', ':', '=',
+  'fn f() -> u8:\n  return 0\n', '\nfn', '\ntype T = u8\n', '  pass\n', 'x: u8 = 1\n'
+]
+
+def get_option(name, default):
+  return argv[argv.index(name) + 1] if name in argv else default
+
+def dump(obj):
+  if isinstance(obj, Node):
+    return ('node', obj.kind, sorted((k, dump(v)) for k, v in obj.get_fields().items()))
+
+  if isinstance(obj, Token):
+    return ('tok', obj.kind, obj.value, obj.indent, obj.is_on_new_line, dump(obj.pos))
+
+  if isinstance(obj, Pos):
+    return obj.offset
+
+  if isinstance(obj, list):
+    return [dump(e) for e in obj]
+
+  return obj
+
+def run_captured(fn):
+  out = StringIO()
+
+  with redirect_stdout(out):
+    try:
+      return 'ok', fn()
+    except SystemExit as e:
+      return 'error', out.getvalue() + str(e.code)
+
+def lex_and_parse(src, path):
+  toks = lex_regex(src, path)
+  return toks, parse(toks)
+
+def random_edit(rnd, src):
+  start = rnd.randint(0, len(src))
+  end = min(start + rnd.choice([0, 0, 1, 2, 10, 80]), len(src))
+
+  return start, end, rnd.choice(EDIT_TEXTS) if rnd.random() < 0.7 else ''
+
+def check_module(rnd, name, src, edits_count):
+  path = join(ROOT, name)
+  m = IncrementalModule(src, path)
+  failures = 0
+  errors = 0
+
+  for _ in range(edits_count):
+    start, end, text = random_edit(rnd, m.src)
+    new_src = m.src[:start] + text + m.src[end:]
+
+    got = run_captured(lambda: m.edit(start, end, text))
+    expected = run_captured(lambda: lex_and_parse(new_src, path))
+
+    if got[0] != expected[0]:
+      print(f'[X] {name}: edit {start}..{end} {text!r}: incremental {got[0]}, from scratch {expected[0]}')
+      print(f'  {got[1] if got[0] == "error" else expected[1]}')
+      return failures + 1, errors
+
+    if got[0] == 'error':
+      if got[1] != expected[1]:
+        print(f'[X] {name}: edit {start}..{end} {text!r}: errors differ')
+        print(f'  incremental:  {got[1]!r}')
+        print(f'  from scratch: {expected[1]!r}')
+        failures += 1
+
+      # the module is left as it was before the edit
+      errors += 1
+      failures += m.src != src
+      continue
+
+    if dump(m.toks) != dump(expected[1][0]) or dump(m.ast) != dump(expected[1][1]):
+      print(f'[X] {name}: edit {start}..{end} {text!r}: tokens or ast differ')
+      return failures + 1, errors
+
+    src = new_src
+
+  return failures, errors
+
+def bench_keystroke(lines_count):
+  src = generate_module(lines_count)
+  path = join(ROOT, 'benchmarks', f'Synthetic{lines_count}.zpp')
+  m = IncrementalModule(src, path)
+  offset = src.index('return ', len(src) // 2) + len('return ')
+
+  start = perf_counter()
+  lex_and_parse(src[:offset] + ' ' + src[offset:], path)
+  full_time = perf_counter() - start
+
+  start = perf_counter()
+  m.edit(offset, offset, ' ')
+  incremental_time = perf_counter() - start
+
+  print(f'[+] a keystroke on synthetic/{lines_count}: {full_time * 1000:.1f} ms from scratch, {incremental_time * 1000:.1f} ms incremental')
+
+def main():
+  edits_count = int(get_option('--edits', DEFAULT_EDITS))
+  rnd = Random(int(get_option('--seed', 0)))
+  paths = sorted(glob(join(ROOT, 'Packages', 'System', '*.zpp')))
+  failures = 0
+  errors = 0
+
+  for path in paths:
+    with open(path, 'r') as f:
+      src = f.read()
+
+    f, e = check_module(rnd, relpath(path, ROOT), src, edits_count // len(paths))
+    failures += f
+    errors += e
+
+  print(f'[+] {edits_count} edits checked ({errors} of them rejected with an error), {failures} differences')
+  bench_keystroke(20000)
+
+  return 1 if failures > 0 else 0
+
+if __name__ == '__main__':
+  exit(main())
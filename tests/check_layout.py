@@ -0,0 +1,98 @@
+# usage:
+#   python tests/check_layout.py [--types N] [--seed S]
+#
+# builds random structs, unions, arrays and vectors and checks that the size, alignment
+# and field offsets of `RealType.calculate_layout` are the ones llvm gives to the lowered
+# type in the data layout of the native target, then shows the padding that
+# `reorder!(..)` saves on the random structs
+
+from os.path import abspath, dirname, join
+from random import Random
+from sys import argv, path as sys_path
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys_path.insert(0, join(ROOT, 'Source'))
+
+from backend import get_target_machine
+from data import RealType
+from layout import get_struct_padding
+from lex import lex
+from mapast import cache_mapast
+from parse import parse
+
+import llvmlite.binding as llvm
+import llvmlite.ir as ll
+import utils
+
+DEFAULT_TYPES = 2000
+SCALAR_KINDS = ['i8_rt', 'i16_rt', 'i32_rt', 'i64_rt', 'u8_rt', 'u16_rt', 'u32_rt', 'u64_rt', 'f32_rt', 'f64_rt']
+
+def get_option(name, default):
+  return argv[argv.index(name) + 1] if name in argv else default
+
+def random_type(rnd, depth=0):
+  if depth > 2 or rnd.random() < 0.5:
+    if rnd.random() < 0.15:
+      return RealType('ptr_rt', is_mut=False, type=RealType('u8_rt'))
+
+    return RealType(rnd.choice(SCALAR_KINDS))
+
+  match rnd.choice(['struct_rt', 'struct_rt', 'union_rt', 'static_array_rt', 'static_vector_rt']):
+    case 'static_array_rt':
+      return RealType('static_array_rt', length=rnd.randint(1, 5), type=random_type(rnd, depth + 1))
+
+    case 'static_vector_rt':
+      return RealType('static_vector_rt', length=rnd.randint(1, 5), type=RealType(rnd.choice(SCALAR_KINDS)))
+
+    case kind:
+      return RealType(kind, fields={ f'f{i}': random_type(rnd, depth + 1) for i in range(rnd.randint(1, 6)) })
+
+def get_generator():
+  path = join(ROOT, 'tests', 'CheckLayout.zpp')
+  utils.setup_globals()
+
+  return cache_mapast(path, parse(lex('', path)))
+
+def main():
+  rnd = Random(int(get_option('--seed', 0)))
+  g = get_generator()
+  realtypes = [random_type(rnd, depth=1) for _ in range(int(get_option('--types', DEFAULT_TYPES)))]
+
+  module = ll.Module(context=utils.llvm_context)
+
+  for i, rt in enumerate(realtypes):
+    llvmtype = g.convert_realtype_to_llvmtype(rt)
+    ll.GlobalVariable(module, llvmtype, f'g{i}').initializer = ll.Constant(llvmtype, None)
+
+  target_data = get_target_machine(0).target_data
+  m = llvm.parse_assembly(str(module))
+  m.data_layout = str(target_data)
+  failures = 0
+
+  for i, rt in enumerate(realtypes):
+    llvmtype = m.get_global_variable(f'g{i}').global_value_type
+    expected = (target_data.get_abi_size(llvmtype), target_data.get_abi_alignment(llvmtype))
+
+    if rt.is_struct():
+      expected += (tuple(target_data.get_element_offset(llvmtype, j) for j in range(len(rt.fields))),)
+      _, _, offsets = rt.calculate_struct_layout()
+      got = rt.calculate_layout() + (tuple(offsets.values()),)
+    else:
+      got = rt.calculate_layout()
+
+    if got != expected:
+      print(f'[X] {rt}: {got}, llvm {expected}')
+      failures += 1
+
+  structs = [rt for rt in realtypes if rt.is_struct()]
+  padding = sum(get_struct_padding(rt) for rt in structs)
+  reordered_padding = sum(get_struct_padding(rt, rt.get_reordered_fields()) for rt in structs)
+  size = sum(rt.calculate_size() for rt in structs)
+
+  print(f'[+] {len(realtypes)} layouts checked, {failures} differences')
+  print(f'[+] {len(structs)} structs, {size} bytes with {padding} of padding, {reordered_padding} of padding once reordered')
+
+  return 1 if failures > 0 else 0
+
+if __name__ == '__main__':
+  exit(main())
@@ -0,0 +1,108 @@
+# usage:
+#   python tests/check_lexers.py [--fuzz N] [--seed S]
+#
+# checks that the regex lexer produces the same tokens, or the same error,
+# of the classic one over every module of the repository and over random inputs
+
+from contextlib import redirect_stdout
+from glob import glob
+from io import StringIO
+from os.path import abspath, dirname, join, relpath
+from random import Random
+from sys import argv, path as sys_path
+from time import perf_counter
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys_path.insert(0, join(ROOT, 'Source'))
+sys_path.insert(0, join(ROOT, 'benchmarks'))
+
+from lex import lex_classic, lex_regex
+from synthetic import generate_module
+
+DEFAULT_FUZZ = 20000
+FUZZ_ALPHABET = [
+  'a', 'Z', '_', '0', '7', '²', '٣', 'é', 'fn', 'if', 'True',
+  ' ', ' ', '  ', '\n', '\n', '\t', '\r', '\\', '-', '--', '.', '..', "'", '`',
+  '=', '>', '<', '!', '+', '*', '(', ')', ':', ',', '\\n', "\\'", '\\q'
+]
+
+def get_option(name, default):
+  return argv[argv.index(name) + 1] if name in argv else default
+
+def run_lexer(lexer, src):
+  out = StringIO()
+
+  with redirect_stdout(out):
+    try:
+      toks = lexer(src, 'input.zpp')
+    except SystemExit as e:
+      return ('error', out.getvalue(), e.code)
+
+  return ('ok', [(t.kind, t.value, t.indent, t.is_on_new_line, t.pos.offset, type(t)) for t in toks])
+
+def check(name, src):
+  expected = run_lexer(lex_classic, src)
+  got = run_lexer(lex_regex, src)
+
+  if expected != got:
+    print(f'[X] lexers differ on {name}: {src!r}')
+    print(f'  classic: {str(expected)[:500]}')
+    print(f'  regex:   {str(got)[:500]}')
+    return False
+
+  return True
+
+def mutate(rnd, src):
+  src = list(src)
+
+  for _ in range(rnd.randint(1, 4)):
+    i = rnd.randint(0, len(src))
+
+    if rnd.random() < 0.5 and i < len(src):
+      del src[i]
+    else:
+      src.insert(i, rnd.choice(FUZZ_ALPHABET))
+
+  return ''.join(src)
+
+def main():
+  fuzz_count = int(get_option('--fuzz', DEFAULT_FUZZ))
+  rnd = Random(int(get_option('--seed', 0)))
+  corpus = {}
+
+  for path in sorted(glob(join(ROOT, '**', '*.zpp'), recursive=True)):
+    with open(path, 'r') as f:
+      corpus[relpath(path, ROOT)] = f.read()
+
+  corpus['synthetic/10000'] = generate_module(10000)
+  failures = 0
+
+  for name, src in corpus.items():
+    failures += not check(name, src)
+
+  snippets = [src[i:i + 200] for src in corpus.values() for i in range(0, len(src), 200)]
+
+  for i in range(fuzz_count):
+    if i % 2 == 0:
+      src = ''.join(rnd.choice(FUZZ_ALPHABET) for _ in range(rnd.randint(0, 30)))
+    else:
+      src = mutate(rnd, rnd.choice(snippets))
+
+    failures += not check(f'fuzz input {i}', src)
+
+    if failures > 10:
+      break
+
+  for name, lexer in [('classic', lex_classic), ('regex', lex_regex)]:
+    start = perf_counter()
+
+    for src in corpus.values():
+      lexer(src, 'input.zpp')
+
+    print(f'[+] {name} lexer: {(perf_counter() - start) * 1000:.1f} ms over the corpus')
+
+  print(f'[+] {len(corpus)} modules and {fuzz_count} random inputs checked, {failures} differences')
+  return 1 if failures > 0 else 0
+
+if __name__ == '__main__':
+  exit(main())
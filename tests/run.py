@@ -0,0 +1,29 @@
+# usage:
+#   python tests/run.py
+#
+# runs every `check_*.py` script of this folder with its default options,
+# the tests of the language itself are in `Samples/Tests.zpp`
+
+from glob import glob
+from os.path import abspath, basename, dirname, join
+from subprocess import run
+from sys import executable
+
+TESTS_DIR = dirname(abspath(__file__))
+
+def main():
+  failed = []
+
+  for path in sorted(glob(join(TESTS_DIR, 'check_*.py'))):
+    print(f'[+] {basename(path)}', flush=True)
+
+    if run([executable, path]).returncode != 0:
+      failed.append(basename(path))
+
+  for name in failed:
+    print(f'[X] {name} failed')
+
+  return 1 if len(failed) > 0 else 0
+
+if __name__ == '__main__':
+  exit(main())